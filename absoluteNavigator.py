@@ -7,6 +7,8 @@ from datetime import datetime
 import copy
 import json
 
+from pointCloud import TileIndex, TileManager
+
 class AbsoluteLidarNavigator(NavigatorBase):
 
     def __init__(self, args):
@@ -23,6 +25,12 @@ class AbsoluteLidarNavigator(NavigatorBase):
 
     def load_point_cloud(self, path):
 
+        # A directory of .laz tiles is indexed, and the tiles are only loaded when they are needed.
+        self.tiles = None
+        if os.path.isdir(path):
+            self.load_tiles(path)
+            return
+
         cloud_meta_data_path = path.replace(".pcd", "-meta.json")
 
         with tqdm(total=1, desc="Loading point cloud", **self.tqdm_config) as pbar:
@@ -31,15 +39,83 @@ class AbsoluteLidarNavigator(NavigatorBase):
                 data = json.load(outfile)
 
             self.full_point_cloud_offset = np.array([data["offset"][0], data["offset"][1], data["offset"][2]])
-            self.full_cloud = o3d.io.read_point_cloud(path)
 
-            self.full_cloud.paint_uniform_color([0.3, 0.6, 1.0])
+            if getattr(self.args, "float32", False):
+                # Keep the (local) points of the cloud in a float32 array, and only create Open3D clouds
+                # for the small parts that are cropped out around the current position. The normals (used
+                # by point-to-plane registration) are kept next to the positions, as columns 3-5.
+                tensor_cloud = o3d.t.io.read_point_cloud(path)
+                columns = [tensor_cloud.point["positions"].numpy()]
+                if "normals" in tensor_cloud.point:
+                    columns.append(tensor_cloud.point["normals"].numpy())
+                self.full_cloud_points = np.hstack(columns).astype(np.float32, copy=False)
+                tensor_cloud = None
+                self.full_cloud = None
+            else:
+                self.full_cloud_points = None
+                self.full_cloud = o3d.io.read_point_cloud(path)
+                self.full_cloud.paint_uniform_color([0.3, 0.6, 1.0])
 
             pbar.update(1)
 
         tqdm.write("Point cloud metadata:")
         tqdm.write(json.dumps(data, indent=4, sort_keys=True))
 
+    def load_tiles(self, path):
+        index = TileIndex(path)
+
+        self.tiles = TileManager(
+            index, 
+            int(self.args.tile_cache_mb * 1024 * 1024), 
+            self.args.tile_voxel_size, 
+            np.float32 if getattr(self.args, "float32", False) else np.float64
+        )
+        self.full_point_cloud_offset = index.offset
+        self.full_cloud_points = None
+        self.full_cloud = None
+
+        tqdm.write(f"Point cloud tiles: {len(index)} tiles in {path}, using the offset {index.offset.tolist()}")
+
+    def get_full_cloud(self):
+        """Returns the full point cloud as an Open3D cloud (creating it from the float32 points if needed).
+        With a tiled point cloud, only the currently loaded tiles are returned."""
+
+        if self.tiles is not None:
+            cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(self.tiles.get_loaded_points().astype(np.float64)))
+            cloud.paint_uniform_color([0.3, 0.6, 1.0])
+            return cloud
+
+        if self.full_cloud is None:
+            self.full_cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(self.full_cloud_points[:, :3].astype(np.float64)))
+            self.full_cloud.paint_uniform_color([0.3, 0.6, 1.0])
+
+        return self.full_cloud
+
+    @staticmethod
+    def to_open3d_cloud(points):
+        """Creates an Open3D cloud from an (N, 3) array of points, or an (N, 6) array with the normals after the positions.
+        Clouds without normals get them estimated, as point-to-plane registration needs normals in the target cloud."""
+
+        cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points[:, :3].astype(np.float64)))
+
+        if points.shape[1] >= 6:
+            cloud.normals = o3d.utility.Vector3dVector(points[:, 3:6].astype(np.float64))
+        else:
+            cloud.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.1, max_nn=30))
+
+        return cloud
+
+    @staticmethod
+    def crop(cloud, min_bound, max_bound):
+        """Crops an Open3D cloud, or an (N, 3) array of points (or (N, 6) with the normals after the positions), to the given box."""
+
+        if isinstance(cloud, np.ndarray):
+            inside = np.all(cloud[:, :3] >= min_bound.astype(cloud.dtype), axis=1)
+            inside &= np.all(cloud[:, :3] <= max_bound.astype(cloud.dtype), axis=1)
+            return cloud[inside]
+
+        return cloud.crop(o3d.geometry.AxisAlignedBoundingBox(min_bound=min_bound, max_bound=max_bound))
+
     def navigate_through_file(self):
         """ Runs through each frame in the file. For each pair of frames, use NICP
         to align the frames, then merge them and downsample the result. The transformation
@@ -59,8 +135,9 @@ class AbsoluteLidarNavigator(NavigatorBase):
         if self.preview_always:
             self.vis.refresh_non_blocking()
 
-            if not self.args.hide_point_cloud:
-                self.vis.show_frame(self.full_cloud)
+            # A tiled point cloud is never loaded in full, so it can not be shown.
+            if not self.args.hide_point_cloud and self.tiles is None:
+                self.vis.show_frame(self.get_full_cloud())
 
         self.is_first_frame = True
 
@@ -108,7 +185,7 @@ class AbsoluteLidarNavigator(NavigatorBase):
     def throw_outside_of_cloud(self, actual_position, partial_radius):
         print("")
         print("")
-        self.print_cloud_info("Cloud", self.full_cloud, "    ")
+        self.print_cloud_info("Cloud", self.get_full_cloud(), "    ")
         print("Current position:", actual_position)
         print("Radius:", partial_radius)
         raise Exception("The point cloud contains no points around the current position.")
@@ -169,14 +246,17 @@ class AbsoluteLidarNavigator(NavigatorBase):
 
         if self.last_extracted_frame_coordinate is None or self.last_extracted_frame_coordinate.distance2d(self.current_estimated_coordinate) >= partial_radius * 0.8:
 
-            bbox = o3d.geometry.AxisAlignedBoundingBox(min_bound=pec_np - pr * 2, max_bound=pec_np + pr * 2)
-            self.last_extracted_frame = self.full_cloud.crop(bbox)
+            if self.tiles is not None:
+                self.last_extracted_frame = self.tiles.crop(pec_np - pr * 2, pec_np + pr * 2)
+            else:
+                self.last_extracted_frame = self.crop(self.full_cloud if self.full_cloud_points is None else self.full_cloud_points, pec_np - pr * 2, pec_np + pr * 2)
             self.last_extracted_frame_coordinate = self.current_estimated_coordinate.clone()
            
             self.time("larger partial cloud point extraction")
 
-        bbox = o3d.geometry.AxisAlignedBoundingBox(min_bound=pec_np - pr, max_bound=pec_np + pr)
-        partial_cloud = self.last_extracted_frame.crop(bbox)
+        partial_cloud = self.crop(self.last_extracted_frame, pec_np - pr, pec_np + pr)
+        if isinstance(partial_cloud, np.ndarray):
+            partial_cloud = self.to_open3d_cloud(partial_cloud)
 
         if len(partial_cloud.points) < 10:
             self.throw_outside_of_cloud(self.current_estimated_coordinate, partial_radius)
@@ -221,7 +301,9 @@ class AbsoluteLidarNavigator(NavigatorBase):
     def read_args():
         parser = NavigatorBase.create_parser()
 
-        parser.add_argument('--point-cloud', type=str, required=True, help="An Open3D point cloud file to use for absolute navigation, preferably generated by pointCloud.py. Every frame in the PCAP file(s) is registered against this point cloud in order to geolocate the frames.")
+        parser.add_argument('--point-cloud', type=str, required=True, help="An Open3D point cloud file to use for absolute navigation, preferably generated by pointCloud.py. Every frame in the PCAP file(s) is registered against this point cloud in order to geolocate the frames. Can also be a directory of .laz tiles, which are then loaded only when needed (see --tile-cache-mb).")
+        parser.add_argument('--tile-cache-mb', type=float, default=2048, required=False, help="If --point-cloud is a directory of .laz tiles, the tiles around the current position are loaded on demand, and the least recently used tiles are thrown out when the loaded tiles use more than this much memory (in megabytes).")
+        parser.add_argument('--tile-voxel-size', type=float, default=None, required=False, help="If --point-cloud is a directory of .laz tiles, and this is given, each tile is downsampled with this voxel size when it is loaded.")
         parser.add_argument('--hide-point-cloud', dest='hide_point_cloud', default=False, action='store_true', help="If set to true, the full point cloud will not be displayed in the visualization. Can be useful for a visualization performance boost, or if the frames drawn together with the cloud gets too chaotic.")
         parser.add_argument('--cloud-part-radius', type=float, default=30, required=False, help="The radius of the part of the cloud that is extracted for local registration -- frames are registered against these extracted parts of the full cloud, as registration against the full cloud is very time consuming, and gives poor results.")
         
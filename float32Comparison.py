@@ -0,0 +1,48 @@
+import os
+import copy
+import numpy as np
+from tabulate import tabulate
+
+from absoluteNavigator import AbsoluteLidarNavigator
+
+# Runs absolute navigation twice on the same data, first with 64-bit floats and then with 32-bit floats (--float32),
+# and compares the estimated positions and the summaries of the two runs. Takes the same arguments as
+# absoluteNavigator.py. If --save-to is given, the results of the runs are saved in the subfolders float64 and float32.
+
+def run(args, name, float32):
+    run_args = copy.copy(args)
+    run_args.float32 = float32
+    run_args.preview = "never"
+
+    if args.save_to is not None:
+        run_args.save_to = os.path.join(args.save_to, name)
+
+    navigator = AbsoluteLidarNavigator(run_args)
+    results = navigator.navigate_through_file()
+
+    return (navigator.estimated_coordinates.points(), results)
+
+if __name__ == "__main__":
+
+    args = AbsoluteLidarNavigator.read_args()
+
+    (estimates64, results64) = run(args, "float64", False)
+    (estimates32, results32) = run(args, "float32", True)
+
+    count = min(len(estimates64), len(estimates32))
+    differences = np.linalg.norm(estimates64[:count] - estimates32[:count], axis=1)
+    differences2d = np.linalg.norm(estimates64[:count, :2] - estimates32[:count, :2], axis=1)
+
+    print("Difference between the estimated positions (float64 vs float32):")
+    print(tabulate([
+        ["Frames (float64/float32):", f"{len(estimates64)}/{len(estimates32)}"],
+        ["Max difference 3d:", np.max(differences) if count > 0 else float('nan')],
+        ["Avg difference 3d:", np.mean(differences) if count > 0 else float('nan')],
+        ["Max difference 2d:", np.max(differences2d) if count > 0 else float('nan')],
+        ["Avg difference 2d:", np.mean(differences2d) if count > 0 else float('nan')]
+    ]))
+
+    print("Summaries:")
+    summary64 = results64["summary"]
+    summary32 = results32["summary"]
+    print(tabulate([[a[0], a[1], b[1]] for (a, b) in zip(summary64, summary32)], headers=["", "float64", "float32"]))
@@ -8,6 +8,7 @@ from datetime import datetime
 import copy
 import json
 from absoluteNavigator import AbsoluteLidarNavigator
+from pcap.framePrefetcher import FramePrefetcher
 
 class NavigationBrowser(AbsoluteLidarNavigator):
 
@@ -19,26 +20,83 @@ class NavigationBrowser(AbsoluteLidarNavigator):
         AbsoluteLidarNavigator.__init__(self, args)
         self.initialize_navigation(rotate_sbet=False)
         self.vis = Open3DVisualizer()
-        self.vis.add_geometry(self.full_cloud)
+
+        # A tiled point cloud is never loaded in full, so only the tiles around the shown frame are loaded 
+        # (and shown). They are replaced when the frame gets close to the edge of the shown area (see set_frame).
+        self.shown_cloud = None
+        self.shown_cloud_center = None
+        self.shown_cloud_radius = self.args.cloud_part_radius * 4
+        if self.tiles is not None:
+            self.show_tiles_around(self.sbet_coordinates[self.reader.get_current_frame_index() + 1].np())
+        else:
+            self.shown_cloud = self.get_full_cloud()
+            self.vis.add_geometry(self.shown_cloud)
+
         self.vis.add_geometry(self.actual_movement_path)
         self.shown_frame = None
         self.heading_offset = 0
 
-        self.next_frame(True)
+        # Frames are read on a background thread, ahead of and behind the shown frame. Since the reader
+        # is moved around by the prefetcher, the index of the shown frame is kept here.
+        self.prefetcher = FramePrefetcher(self.load_frame)
+        self.frame_ix = self.reader.get_current_frame_index() + 1
+
+        self.show_frame_ix(self.frame_ix, True)
+
+    def load_frame(self, num):
+        """Reads the frame with the given index for the prefetcher. Returns None only when the index is past
+        the end of the file(s), and FramePrefetcher.UNAVAILABLE if the reader gives no frame (or a frame with
+        another index) for an index within them, so that a frame is never cached under another index than its own."""
+
+        has_seeked = num != self.reader.get_current_frame_index() + 1
+        if has_seeked and not self.reader.seek(num):
+            return None
+
+        frame = self.reader.next_frame(False, None, False)
+
+        if frame is None:
+            return FramePrefetcher.UNAVAILABLE if has_seeked else None
+
+        if self.reader.get_current_frame_index() != num:
+            return FramePrefetcher.UNAVAILABLE
 
-    def next_frame(self, is_first=False):
+        return frame
 
-        frame = self.reader.next_frame(False, self.timer, False)
+    def show_frame_ix(self, num, is_first=False):
+
+        frame = self.prefetcher.get(num)
         
         if frame is None:
             print("Empty frame -- probably end of file.")
             return
 
+        self.frame_ix = num
         self.set_frame(frame, is_first)
 
+    def show_tiles_around(self, center):
+        """Shows the points of the point cloud tiles within shown_cloud_radius of the given (local) coordinate,
+        instead of the previously shown points."""
+
+        radius = self.shown_cloud_radius
+        cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(self.tiles.crop(center - radius, center + radius)[:, :3].astype(np.float64)))
+        cloud.paint_uniform_color([0.3, 0.6, 1.0])
+
+        if self.shown_cloud is not None:
+            self.vis.remove_geometry(self.shown_cloud)
+
+        self.vis.add_geometry(cloud)
+        self.shown_cloud = cloud
+        self.shown_cloud_center = np.array(center, dtype=np.float64)
+
+    def get_current_actual_coordinate(self):
+        ix = max(0, self.frame_ix + self.frame_index_offset)
+        return self.sbet_coordinates[ix]
+
     def set_frame(self, frame, is_first=False):
         
-        self.read_frame = copy.deepcopy(frame)
+        # The given frame is kept unchanged (it may be a prefetched frame), and a copy is moved into place.
+        self.read_frame = frame
+        frame = copy.deepcopy(frame)
 
         coordinate = self.get_current_actual_coordinate()
 
@@ -47,6 +105,10 @@ class NavigationBrowser(AbsoluteLidarNavigator):
         print(f"Heading offset: {self.heading_offset/100.0:.2f}")
         print(coordinate)
 
+        # Load the tiles around the frame once it gets within half the radius from the edge of the shown tiles.
+        if self.tiles is not None and np.max(np.abs(coordinate.np()[:2] - self.shown_cloud_center[:2])) > self.shown_cloud_radius / 2:
+            self.show_tiles_around(coordinate.np())
+
         R = frame.get_rotation_matrix_from_xyz((coordinate.roll, coordinate.pitch, self.get_corrected_heading(coordinate.heading + self.heading_offset / 100.0)))
         frame.rotate(R, center=[0,0,0])
 
@@ -61,7 +123,10 @@ class NavigationBrowser(AbsoluteLidarNavigator):
     def start(self):
     
         def key_n(vis):
-            self.next_frame()
+            self.show_frame_ix(self.frame_ix + 1)
+    
+        def key_b(vis):
+            self.show_frame_ix(self.frame_ix - 1)
     
         def key_left(vis):
             self.heading_offset += 1
@@ -79,7 +144,8 @@ class NavigationBrowser(AbsoluteLidarNavigator):
             self.frame_index_offset -= 1
             self.set_frame(self.read_frame)
 
-        self.vis.register_key_callback(78, key_n)
+        self.vis.register_key_callback(78, key_n) # N
+        self.vis.register_key_callback(66, key_b) # B
         self.vis.register_key_callback(262, key_right)
         self.vis.register_key_callback(263, key_left)
         self.vis.register_key_callback(264, key_down)
@@ -89,6 +155,9 @@ class NavigationBrowser(AbsoluteLidarNavigator):
         self.vis.reset_view()
         self.vis.run()
 
+        self.prefetcher.stop()
+        self.prefetcher.print_statistics()
+
 if __name__ == "__main__":
 
     browser = NavigationBrowser(AbsoluteLidarNavigator.read_args())
@@ -13,6 +13,7 @@ from pcap.pcapReaderHelper import PcapReaderHelper
 from utils.open3dVisualizer import Open3DVisualizer
 from utils.plotter import Plotter
 from sbet.sbetParser import SbetRow
+from sbet.trajectory import Trajectory
 import argparse
 
 class NavigatorBase:
@@ -92,9 +93,16 @@ class NavigatorBase:
         self.skip_to_frame(self.skip_start, "Skipping frames")
 
     def skip_to_frame(self, frame_index, desc):
+
+        # Jump directly to the frame using the frame index, instead of decoding every skipped frame.
+        with tqdm(total=1, desc=desc, **self.tqdm_config) as pbar:
+            if not self.reader.seek(frame_index):
+                raise Exception(f"Can not skip to frame {frame_index}, since it is past the end of the file(s).")
+            pbar.update(1)
+
         self.frame_limit -= frame_index
-        for _ in tqdm(range(0, frame_index), desc=desc, **self.tqdm_config):
-            self.reader.next_frame(False, self.timer)
+
+        self.time("frame skipping")
 
     def skip_until_circle(self):
         """ The "skip until" circle is used to skip frames until the actual position has entered a circle given by the 
@@ -114,12 +122,11 @@ class NavigatorBase:
         self.skip_to_frame(skip_until, "Skipping until entering circle")
 
     def find_first_frame_entering_circle(self, circle):
-        for (ix, position) in enumerate(self.sbet_coordinates):
-            distance = circle.distance2d(position)
-            if distance <= circle.radius:
-                return (ix, position)
+        ix = self.sbet_coordinates.find_first_inside_circle(circle, circle.radius)
+        if ix < 0:
+            return (-1, None)
 
-        return (-1, None)
+        return (ix, self.sbet_coordinates[ix])
 
     def initialize_navigation(self, initial_movement=[], rotate_sbet=False):
         self.timer.reset()
@@ -129,9 +136,9 @@ class NavigatorBase:
         # source frame.
         self.movements = []
         self.registration_configs = []
-        self.actual_coordinates = []
-        self.estimated_coordinates = []
-        self.sbet_coordinates = []
+        self.actual_coordinates = Trajectory()
+        self.estimated_coordinates = Trajectory()
+        self.sbet_coordinates = Trajectory()
         self.actual_movement_path = None
 
         self.movement_path = o3d.geometry.LineSet(
@@ -149,7 +156,7 @@ class NavigatorBase:
         # If there is no point cloud offset here (incremental navigation), create an
         # offset based on the SBET coordinates instead
         if self.full_point_cloud_offset is None:
-            points = [[c.x, c.y, c.alt] for c in self.sbet_coordinates]
+            points = self.sbet_coordinates.points()
             mins = np.amin(points, axis=0)
             maxes = np.amax(points, axis=0)
             self.full_point_cloud_offset = mins + (maxes - mins) / 2
@@ -159,8 +166,7 @@ class NavigatorBase:
 
         # Translate all coordinates towards origo with the same offset as
         # the point cloud.
-        for c in self.sbet_coordinates:
-            c.translate(-self.full_point_cloud_offset)
+        self.sbet_coordinates.translate(-self.full_point_cloud_offset)
 
         if self.skip_until_circle_center is not None:
             
@@ -170,7 +176,7 @@ class NavigatorBase:
             # Then skip frames until the skip circle
             self.skip_until_circle()
         
-        self.actual_movement_path = self.create_line([[p.x, p.y, p.alt] for p in self.sbet_coordinates], color=[0, 0, 1])
+        self.actual_movement_path = self.create_line(self.sbet_coordinates.points(), color=[0, 0, 1])
 
         self.actual_position_cylinder = self.create_cylinder(size_ratio=1, color=[0,0,1])
         self.estimated_position_cylinder = self.create_cylinder(size_ratio=1, color=[1,0,0])
@@ -282,12 +288,8 @@ class NavigatorBase:
 
         # Retrieve the SBET data for this frame, which has
         # already been transformed to fit the point cloud.
-        pos = self.sbet_coordinates[ix]
-
-        # Set the frame_ix as an additional parameter
-        pos.frame_ix = ix
-
-        return pos
+        # This is a view into the trajectory, with the frame_ix set to ix.
+        return self.sbet_coordinates[ix]
 
     def rotate_frame(self, frame, coordinate=None):
 
@@ -555,9 +557,9 @@ class NavigatorBase:
 
         self.plot = Plotter(self.preview_always)
 
-        # Add the first coordinates to the lists
-        self.estimated_coordinates.append(self.current_estimated_coordinate.clone())
-        self.actual_coordinates.append(self.initial_coordinate.clone())
+        # Add the first coordinates to the lists (the values are copied into the trajectories)
+        self.estimated_coordinates.append(self.current_estimated_coordinate)
+        self.actual_coordinates.append(self.initial_coordinate)
 
     def finish_plot_and_visualization(self):
         
@@ -616,9 +618,9 @@ class NavigatorBase:
 
         if self.current_estimated_coordinate is not None:
 
-            # Add the current coordinate to the list of estimations
-            self.estimated_coordinates.append(self.current_estimated_coordinate.clone())
-            self.actual_coordinates.append(actual_coordinate.clone())
+            # Add the current coordinate to the list of estimations (the values are copied into the trajectories)
+            self.estimated_coordinates.append(self.current_estimated_coordinate)
+            self.actual_coordinates.append(actual_coordinate)
 
             # Calculate differences between the estimate and the actual coordinate
             dx = abs(self.current_estimated_coordinate.x - actual_coordinate.x)
@@ -791,7 +793,7 @@ class NavigatorBase:
                 arg_key = key.replace("--", "").replace("-", "_")
 
                 # Ignore absoluteNavigator arguments to allow common .json file
-                if arg_key in ["point_cloud", "hide_point_cloud", "cloud_part_radius"]:
+                if arg_key in ["point_cloud", "hide_point_cloud", "cloud_part_radius", "tile_cache_mb", "tile_voxel_size"]:
                     continue
 
                 if not arg_key in arg_keys:
@@ -1,4 +1,5 @@
 from ouster import client, pcap
+from collections import OrderedDict
 import open3d as o3d
 import argparse
 
@@ -14,24 +15,65 @@ class BufferedPcapReader(PcapReader):
 
         PcapReader.__init__(self, pcap_path, metadata_path, 0, args)
 
-        self.prepared_clouds = []
+        # Recently used raw frames, with the least recently used first. The total size of the cached
+        # frames is kept below frame_cache_bytes by throwing out the least recently used frames.
+        self.prepared_clouds = OrderedDict()
+        self.prepared_clouds_bytes = 0
+        self.frame_cache_bytes = int((getattr(args, "frame_cache_mb", None) or 1024) * 1024 * 1024)
 
-    def read_frame(self, num:int, remove_vehicle:bool = False):
-        """Retrieves the current frame from an array of read frames. The array is lazily
-        filled with data from the pcap file as new frames are requested. Old frames are
-        never thrown out, so this will case memory issues if the pcap file gets large enough."""
+    def read_frame(self, num:int, remove_vehicle:bool = False, as_frame:bool = False, colored:bool = True):
+        """Retrieves the frame with the given index, filtered with the current settings (vehicle removal,
+        max distance and colorization). The frames are cached before filtering, so changing the settings
+        does not require decoding the frames again. Frames that are not in the cache are read from the 
+        pcap file, using the frame index to jump directly to the frame (in either direction). The least 
+        recently used frames are thrown out when the cache grows beyond its memory budget. The frames 
+        are returned as Open3D point clouds, or as Frame objects if as_frame is True."""
+
+        frame = self.read_raw_frame(num)
+
+        if frame is None:
+            return None
+
+        frame = self.filter_frame(frame, remove_vehicle, colored=colored)
+
+        return frame if as_frame else frame.to_legacy()
+
+    def read_raw_frame(self, num:int):
+        """Retrieves the frame with the given index from the cache, or from the pcap file, without any
+        filtering except for the removal of invalid points (see next_frame with raw=True)."""
 
         # If given a negative index, return None.
         if num < 0:
             return None
 
-        # Lazily read frames until the given index is available.
-        while len(self.prepared_clouds) < num + 1:
-            self.prepared_clouds.append(self.next_frame(remove_vehicle))
+        if num in self.prepared_clouds:
+            self.prepared_clouds.move_to_end(num)
+            return self.prepared_clouds[num]
+
+        frame = self.decode_frame(num)
+        if frame is not None:
+            self.add_to_cache(num, frame)
+
+        return frame
+
+    def decode_frame(self, num:int):
+        """Reads the raw frame with the given index from the pcap file, continuing from the current
+        position if possible, and seeking otherwise. Returns None if the index is past the end."""
+
+        if num != self.get_current_frame_index() + 1 and not self.seek(num):
+            return None
+
+        return self.next_frame(as_frame=True, raw=True)
+
+    def add_to_cache(self, key, frame):
+        self.prepared_clouds[key] = frame
+        self.prepared_clouds_bytes += frame.nbytes
 
-        # Retrieve the requested frame, which will now be read.
-        return self.prepared_clouds[num]
+        # Always keep the newest frame, even if it is larger than the budget on its own.
+        while self.prepared_clouds_bytes > self.frame_cache_bytes and len(self.prepared_clouds) > 1:
+            (_, evicted) = self.prepared_clouds.popitem(last=False)
+            self.prepared_clouds_bytes -= evicted.nbytes
 
     def invalidate_cache(self):
-        self.prepared_clouds = []
-        self.reset()
\ No newline at end of file
+        self.prepared_clouds = OrderedDict()
+        self.prepared_clouds_bytes = 0
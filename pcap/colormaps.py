@@ -3,21 +3,23 @@
 import numpy as np
 
 
-def colorize(image: np.ndarray):
+def colorize(image: np.ndarray, dtype=np.float64):
     """Use Ouster spezia colormap to get from gray to color space.
 
     Args:
         image: 2D array of values in the range [0, 1]
+        dtype: the type of the returned values (np.float64 or np.float32)
 
     Returns:
         Array of RGB values of the same dimension selected from the color map
     """
+    colormap = spezia_float32 if dtype == np.float32 else spezia
     key_img_indices = (255 * image).astype(np.uint8)
-    return np.reshape(np.take(spezia, key_img_indices.flat, axis=0),
+    return np.reshape(np.take(colormap, key_img_indices.flat, axis=0),
                       [image.shape[0], image.shape[1], 3])
 
 
-def normalize(data: np.ndarray, percentile: float = 0.05):
+def normalize(data: np.ndarray, percentile: float = 0.05, dtype=np.float64):
     """Normalize and clamp data for better color mapping.
 
     This is a utility function used ONLY for the purpose of 2D image
@@ -27,16 +29,17 @@ def normalize(data: np.ndarray, percentile: float = 0.05):
     Args:
         data: array of data to be transformed for visualization
         percentile: values in the bottom/top percentile are clambed to 0 and 1
+        dtype: the type of the returned values (np.float64 or np.float32)
 
     Returns:
-        An array of doubles with the same shape as ``image`` with values
-        normalized to the range [0, 1].
+        An array of doubles (or the given dtype) with the same shape as ``image`` 
+        with values normalized to the range [0, 1].
     """
     min_val = np.percentile(data, 100 * percentile)
     max_val = np.percentile(data, 100 * (1 - percentile))
     # to protect from division by zero
     spread = max(max_val - min_val, 1)
-    field_res = (data.astype(np.float64) - min_val) / spread
+    field_res = (data.astype(dtype) - dtype(min_val)) / dtype(spread)
     return field_res.clip(0, 1.0)
 
 
@@ -301,3 +304,5 @@ spezia = np.array(
      [0.9999999999999777, 0.6668888735333959, 0.41140637540952824],
      [0.9999999999999777, 0.6713557295869282, 0.40206789113388525],
      [0.9999999999999775, 0.6758182149038043, 0.3921718908087272]])
+
+spezia_float32 = spezia.astype(np.float32)
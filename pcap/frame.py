@@ -0,0 +1,74 @@
+import open3d as o3d
+import numpy as np
+
+class Frame:
+    """A frame from a PcapReader as NumPy columns, with one row per point. Apart from xyz, all columns
+    are optional (None if not read):
+
+    - xyz: (N, 3) point coordinates relative to the sensor
+    - colors: (N, 3) colors (from the reflectivity)
+    - reflectivity, signal: (N,) raw channel values
+    - ring, column: (N,) the row (beam) and column of each point in the range image (uint16)
+    - timestamp: (N,) the time of the column of each point, in nanoseconds after start_time (uint32)
+    - key: (N,) the reflectivity normalized over the whole frame (in [0, 1]), kept in raw frames so
+      that they can be colored after filtering (see PcapReader.filter_frame)
+
+    start_time is the time of the first column in the frame (unix time in nanoseconds), so the
+    unix timestamp of a point is start_time + timestamp.
+
+    Frames can stay in NumPy through filtering and processing, and are converted to Open3D when
+    needed, either to a legacy point cloud (to_legacy, which copies to float64) or to a tensor
+    point cloud (to_tensor, which shares memory with the arrays).
+    """
+
+    columns = ["xyz", "colors", "reflectivity", "signal", "ring", "column", "timestamp", "key"]
+
+    def __init__(self, xyz, colors=None, reflectivity=None, signal=None, ring=None, column=None, timestamp=None, key=None, start_time=None):
+        self.xyz = xyz
+        self.colors = colors
+        self.reflectivity = reflectivity
+        self.signal = signal
+        self.ring = ring
+        self.column = column
+        self.timestamp = timestamp
+        self.key = key
+        self.start_time = start_time
+
+    def __len__(self):
+        return len(self.xyz)
+
+    @property
+    def nbytes(self):
+        """The total size of all columns, in bytes (using the compact ring/column/timestamp types)."""
+        return sum(getattr(self, name).nbytes for name in Frame.columns if getattr(self, name) is not None)
+
+    def select(self, mask):
+        """Returns a new frame with only the points given by the mask (or indices), for all columns."""
+        return Frame(*[None if getattr(self, name) is None else getattr(self, name)[mask] for name in Frame.columns], start_time=self.start_time)
+
+    def to_legacy(self):
+        """Returns the frame as an o3d.geometry.PointCloud (with colors if available). Legacy point clouds
+        are always float64, so the points are copied."""
+
+        cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(self.xyz.astype(np.float64, copy=False)))
+        if self.colors is not None:
+            cloud.colors = o3d.utility.Vector3dVector(self.colors.astype(np.float64, copy=False))
+
+        return cloud
+
+    def to_tensor(self):
+        """Returns the frame as an o3d.t.geometry.PointCloud, with every available column as a point
+        attribute. The tensors are created with Tensor.from_numpy, so they share memory with the
+        (contiguous) arrays instead of copying them."""
+
+        cloud = o3d.t.geometry.PointCloud(o3d.core.Tensor.from_numpy(np.ascontiguousarray(self.xyz)))
+
+        if self.colors is not None:
+            cloud.point["colors"] = o3d.core.Tensor.from_numpy(np.ascontiguousarray(self.colors))
+
+        for name in ["reflectivity", "signal", "ring", "column", "timestamp"]:
+            values = getattr(self, name)
+            if values is not None:
+                cloud.point[name] = o3d.core.Tensor.from_numpy(np.ascontiguousarray(values).reshape((-1, 1)))
+
+        return cloud
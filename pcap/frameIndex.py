@@ -0,0 +1,105 @@
+from ouster import client
+from tqdm import tqdm
+import numpy as np
+import os
+
+from pcap.indexedPcapSource import IndexedPcapSource
+from utils.atomicFile import atomic_write
+from utils.fileFingerprint import get_file_fingerprint
+
+# One row per frame in the pcap file. The offset is the byte offset of the first record
+# belonging to the frame, and sbet_time is the timestamp used when looking up the SBET
+# position of the frame (see PcapReader.get_sbet_timestamp).
+FRAME_INDEX_DTYPE = np.dtype([
+    ("offset", np.int64),
+    ("frame_id", np.int32),
+    ("first_time", np.int64),
+    ("last_time", np.int64),
+    ("sbet_time", np.int64)
+])
+
+# Increased whenever the way frames are indexed changes, so that older indices are rebuilt.
+FRAME_INDEX_VERSION = 4
+
+class FrameIndex:
+    """The byte offset, frame_id and first/last timestamp of every frame in a pcap file,
+    which allows a reader to jump directly to any frame (or time) without decoding
+    everything before it."""
+
+    def __init__(self, frames, fingerprint):
+        self.frames = frames
+        # The size and mtime of the pcap file the index was built from (see get_file_fingerprint).
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.frames)
+
+    @staticmethod
+    def build(pcap_path, metadata, show_progress=False):
+        """Reads through the given pcap file once and registers where each frame starts."""
+
+        source = IndexedPcapSource(pcap_path, metadata)
+        fingerprint = get_file_fingerprint(pcap_path)
+        file_size = fingerprint["size"]
+
+        frames = []
+        last_frame_id = -1
+        with tqdm(total=file_size, desc="Indexing frames", unit="B", unit_scale=True, ascii=True, leave=False, disable=not show_progress) as pbar:
+            for (offset, packet) in source.enumerate_packets():
+                if not isinstance(packet, client.LidarPacket):
+                    continue
+
+                frame_id = packet.header(client.ColHeader.FRAME_ID)[0]
+                timestamps = packet.header(client.ColHeader.TIMESTAMP)
+
+                if frame_id != last_frame_id:
+                    last_frame_id = frame_id
+                    frames.append([offset, frame_id, timestamps[0], timestamps[-1], timestamps[-1]])
+                    pbar.update(offset - pbar.n)
+                else:
+                    frames[-1][3] = timestamps[-1]
+
+        return FrameIndex(np.array([tuple(x) for x in frames], dtype=FRAME_INDEX_DTYPE), fingerprint)
+
+    @staticmethod
+    def load(path, pcap_path):
+        """Loads a frame index saved by FrameIndex.save. Returns None if the index is missing, if it
+        was created by an older version, or if the pcap file has changed (size or mtime) since it was created."""
+
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with np.load(path) as data:
+                version = int(data["version"]) if "version" in data else 1
+                if version != FRAME_INDEX_VERSION:
+                    return None
+                fingerprint = { "size": int(data["file_size"]), "mtime": float(data["file_mtime"]) }
+                frames = data["frames"]
+        except:
+            return None
+
+        if frames.dtype != FRAME_INDEX_DTYPE or fingerprint != get_file_fingerprint(pcap_path):
+            return None
+
+        return FrameIndex(frames, fingerprint)
+
+    def save(self, path):
+        with atomic_write(path, "wb") as f:
+            np.savez(f, frames=self.frames, file_size=self.fingerprint["size"], file_mtime=self.fingerprint["mtime"], version=FRAME_INDEX_VERSION)
+
+    def get_offset(self, frame_ix):
+        return int(self.frames["offset"][frame_ix])
+
+    def get_range(self, frame_ix):
+        """Returns the (start, end) byte range of the given frame, where end is None for the last frame."""
+
+        end = int(self.frames["offset"][frame_ix + 1]) if frame_ix + 1 < len(self.frames) else None
+        return (self.get_offset(frame_ix), end)
+
+    def find_time(self, unix_ns):
+        """Returns the index of the first frame that ends at or after the given unix timestamp
+        (in nanoseconds), which is the frame containing the timestamp if there is one."""
+
+        ix = int(np.searchsorted(self.frames["last_time"], unix_ns, side="left"))
+        return min(ix, len(self.frames) - 1)
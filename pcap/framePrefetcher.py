@@ -0,0 +1,170 @@
+import threading
+
+class FramePrefetcher:
+    """Loads frames on a background thread for interactive browsing, keeping a window of ready
+    frames around the current position, both ahead of it and behind it. Most of the window is
+    used in the direction of travel (given by the last move), so holding an arrow key in either
+    direction finds the next frame ready, while stepping back still finds the previous frames.
+
+    Frames are loaded with the given load_frame(num) function, which must return None for indices
+    outside of the file, and FramePrefetcher.UNAVAILABLE if the frame could not be read for another
+    reason (it is then not loaded again until invalidate is called, but does not end the file).
+    load_frame is never called from two threads at the same time, so it may use a (non thread safe) 
+    reader. The prefetched frames are thrown away by invalidate, for example when the settings used 
+    by load_frame have changed.
+    """
+
+    # Returned by load_frame for a frame that can not be read, but is not outside of the file.
+    UNAVAILABLE = object()
+
+    def __init__(self, load_frame, window=16):
+        self.load_frame = load_frame
+        self.window = max(2, window)
+
+        self.frames = {}
+        self.current = 0
+        self.direction = 0
+        # Incremented by invalidate, so that frames loaded with old settings are not kept.
+        self.generation = 0
+        # The first index known to be outside of the file, and indices that could not be read.
+        self.end = None
+        self.unavailable = set()
+
+        self.load_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.is_stopped = False
+        self.thread = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_wanted(self):
+        """Returns the indices that should be ready, in the order they should be loaded."""
+
+        behind = self.window // 2 if self.direction == 0 else self.window // 4
+        ahead = self.window - behind
+        step = -1 if self.direction < 0 else 1
+
+        wanted = [self.current]
+        for i in range(1, max(ahead, behind) + 1):
+            if i <= ahead:
+                wanted.append(self.current + i * step)
+            if i <= behind:
+                wanted.append(self.current - i * step)
+
+        return [num for num in wanted if num >= 0 and (self.end is None or num < self.end) and num not in self.unavailable]
+
+    def get(self, num:int):
+        """Returns the frame with the given index, from the prefetched frames if it is ready, and
+        loaded directly otherwise. Moves the prefetch window to this frame."""
+
+        if num < 0:
+            return None
+
+        with self.condition:
+            if num != self.current:
+                self.direction = 1 if num > self.current else -1
+            self.current = num
+            frame = self.frames.get(num)
+            generation = self.generation
+
+        if frame is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            with self.load_lock:
+                frame = self.load_frame(num)
+            self._store(num, frame, generation)
+
+        if frame is FramePrefetcher.UNAVAILABLE:
+            frame = None
+
+        self._start()
+        with self.condition:
+            self.condition.notify_all()
+
+        return frame
+
+    def invalidate(self):
+        """Throws away all prefetched frames."""
+
+        with self.condition:
+            self.generation += 1
+            self.frames = {}
+            self.end = None
+            self.unavailable = set()
+            self.condition.notify_all()
+
+    def _store(self, num, frame, generation):
+        with self.condition:
+            if generation != self.generation:
+                return
+
+            if frame is None:
+                self.end = num if self.end is None else min(self.end, num)
+                return
+
+            if frame is FramePrefetcher.UNAVAILABLE:
+                self.unavailable.add(num)
+                return
+
+            self.frames[num] = frame
+
+            # Drop the frames that are outside of the window.
+            wanted = set(self.get_wanted())
+            for ix in [ix for ix in self.frames if ix not in wanted]:
+                del self.frames[ix]
+
+    def _next_missing(self):
+        with self.condition:
+            for num in self.get_wanted():
+                if num not in self.frames:
+                    return (num, self.generation)
+        return (None, None)
+
+    def _produce(self):
+        """Runs on the background thread until stopped."""
+
+        while True:
+            with self.condition:
+                if self.is_stopped:
+                    return
+
+            (num, generation) = self._next_missing()
+
+            if num is None:
+                with self.condition:
+                    if not self.is_stopped and self._next_missing()[0] is None:
+                        self.condition.wait()
+                continue
+
+            with self.load_lock:
+                frame = self.load_frame(num)
+            self._store(num, frame, generation)
+
+    def _start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background thread."""
+
+        if self.thread is None:
+            return
+
+        with self.condition:
+            self.is_stopped = True
+            self.condition.notify_all()
+
+        self.thread.join()
+        self.thread = None
+
+    def get_prefetch_statistics(self):
+        return { "hits": self.hits, "misses": self.misses }
+
+    def print_statistics(self):
+        total = self.hits + self.misses
+        print(f"Prefetch hits: {self.hits}, misses: {self.misses}" + (f" ({100.0 * self.hits / total:.1f}% hits)" if total > 0 else ""))
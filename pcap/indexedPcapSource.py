@@ -0,0 +1,200 @@
+from ouster import client
+import struct
+
+# Link layer types that we know how to strip off to get to the IP packet.
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+# Incomplete IPv4 datagrams are dropped when this many records have been read since their first fragment.
+# The 16-bit IP id wraps around, so a stale datagram could otherwise be completed by fragments of a new one.
+FRAGMENT_MAX_AGE = 1000
+
+class IndexedPcapSource:
+    """A minimal packet source that reads lidar and IMU packets directly from the records
+    in a (libpcap formatted) pcap file. Unlike ouster.pcap.Pcap, this source can start
+    reading at any byte offset in the file, which makes it possible to jump straight to
+    a frame using the byte offsets stored in a FrameIndex. IP fragments are reassembled,
+    since lidar packets are usually larger than the MTU.
+
+    The source can be given a list of (start, end) byte ranges, in which case only the
+    records starting within these ranges are read. Everything outside of the ranges is
+    never read from disk.
+    """
+
+    def __init__(self, pcap_path, metadata, start_offset=None, ranges=None):
+        self.pcap_path = pcap_path
+        self._metadata = metadata
+
+        packet_format = client.PacketFormat.from_info(metadata)
+        self.lidar_packet_size = packet_format.lidar_packet_size
+        self.imu_packet_size = packet_format.imu_packet_size
+
+        # Packets are told apart by their destination port. If the metadata doesn't give a port (0),
+        # packets of the right size are accepted on any port.
+        self.lidar_port = getattr(metadata, "udp_port_lidar", 0) or 0
+        self.imu_port = getattr(metadata, "udp_port_imu", 0) or 0
+
+        with open(pcap_path, "rb") as f:
+            self._read_global_header(f.read(24))
+
+        if ranges is None:
+            ranges = [(self.data_offset if start_offset is None else start_offset, None)]
+        self.ranges = ranges
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    def _read_global_header(self, header):
+        if len(header) < 24:
+            raise Exception(f"The file {self.pcap_path} is too short to be a pcap file.")
+
+        magic = header[0:4]
+        if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+            self.endian = "<"
+        elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+            self.endian = ">"
+        else:
+            raise Exception(f"Unsupported pcap format in {self.pcap_path} (only libpcap files are supported, not pcapng).")
+
+        # The nanosecond variant has a different magic number, but the same layout.
+        self.fraction_divisor = 1e9 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1e6
+        self.link_type = struct.unpack(self.endian + "I", header[20:24])[0] & 0x0FFFFFFF
+        self.data_offset = 24
+        self.record_header = struct.Struct(self.endian + "IIII")
+
+    def enumerate_records(self):
+        """Yields (offset, timestamp, data) for every record in the configured byte ranges,
+        where offset is the position of the record header in the file."""
+
+        record_header = self.record_header
+        with open(self.pcap_path, "rb") as f:
+            for (start, end) in self.ranges:
+                f.seek(start)
+                offset = start
+                while end is None or offset < end:
+                    header = f.read(16)
+                    if len(header) < 16:
+                        break
+
+                    ts_sec, ts_frac, incl_len, _ = record_header.unpack(header)
+                    data = f.read(incl_len)
+                    if len(data) < incl_len:
+                        break
+
+                    yield (offset, ts_sec + ts_frac / self.fraction_divisor, data)
+                    offset += 16 + incl_len
+
+    def _strip_link_layer(self, data):
+        """Returns the IP packet contained in the given link layer frame, or None if it
+        doesn't contain one."""
+
+        if self.link_type == LINKTYPE_ETHERNET:
+            ether_type = (data[12] << 8) | data[13]
+            ix = 14
+
+            # Skip any VLAN tags
+            while ether_type in (0x8100, 0x88a8) and len(data) >= ix + 4:
+                ether_type = (data[ix + 2] << 8) | data[ix + 3]
+                ix += 4
+
+            if ether_type not in (0x0800, 0x86dd):
+                return None
+            return data[ix:]
+
+        if self.link_type == LINKTYPE_LINUX_SLL:
+            return data[16:]
+
+        if self.link_type == LINKTYPE_NULL:
+            return data[4:]
+
+        if self.link_type == LINKTYPE_RAW:
+            return data
+
+        raise Exception(f"Unsupported link type ({self.link_type}) in {self.pcap_path}.")
+
+    def enumerate_payloads(self):
+        """Yields (offset, timestamp, port, payload) for every UDP datagram in the configured byte ranges,
+        where port is the destination port. Fragmented IPv4 datagrams are reassembled, and the offset is
+        that of the first record containing a part of the datagram."""
+
+        fragments = {}
+
+        for (record_ix, (offset, timestamp, data)) in enumerate(self.enumerate_records()):
+
+            if record_ix % FRAGMENT_MAX_AGE == 0 and len(fragments) > 0:
+                fragments = { key: x for (key, x) in fragments.items() if record_ix - x["record_ix"] < FRAGMENT_MAX_AGE }
+
+            ip = self._strip_link_layer(data)
+            if ip is None or len(ip) < 20:
+                continue
+
+            version = ip[0] >> 4
+
+            if version == 6:
+                # Next header must be UDP (fragmented IPv6 is not supported).
+                if ip[6] == 17:
+                    udp_length = (ip[44] << 8) | ip[45]
+                    yield (offset, timestamp, (ip[42] << 8) | ip[43], ip[48:40 + udp_length])
+                continue
+
+            if version != 4 or ip[9] != 17:
+                continue
+
+            header_length = (ip[0] & 0x0F) * 4
+            total_length = (ip[2] << 8) | ip[3]
+            flags = (ip[6] << 8) | ip[7]
+            fragment_offset = (flags & 0x1FFF) * 8
+            more_fragments = flags & 0x2000
+
+            # Slice away any link layer padding
+            content = ip[header_length:total_length]
+
+            if fragment_offset == 0 and not more_fragments:
+                udp_length = (content[4] << 8) | content[5]
+                yield (offset, timestamp, (content[2] << 8) | content[3], content[8:udp_length])
+                continue
+
+            key = (ip[12:20], ip[4:6])
+            datagram = fragments.get(key)
+
+            # A new first fragment with the same key means that the IP id has been reused, and the old datagram
+            # was never completed, so it is thrown away instead of being mixed with the new one.
+            if datagram is not None and fragment_offset == 0 and 0 in datagram["parts"]:
+                datagram = None
+
+            if datagram is None:
+                datagram = fragments[key] = { "offset": offset, "record_ix": record_ix, "parts": {}, "size": None }
+
+            datagram["parts"][fragment_offset] = content
+            if not more_fragments:
+                datagram["size"] = fragment_offset + len(content)
+
+            if datagram["size"] is None or sum(len(x) for x in datagram["parts"].values()) < datagram["size"]:
+                continue
+
+            del fragments[key]
+
+            content = b"".join(datagram["parts"][x] for x in sorted(datagram["parts"]))
+            udp_length = (content[4] << 8) | content[5]
+            yield (datagram["offset"], timestamp, (content[2] << 8) | content[3], content[8:udp_length])
+
+    def enumerate_packets(self):
+        """Yields (offset, packet) for every lidar or IMU packet in the configured byte ranges. Packets
+        are identified by the lidar/IMU destination ports from the metadata, and the payload size is
+        only checked to skip malformed packets, so other UDP traffic in the capture is ignored."""
+
+        for (offset, timestamp, port, payload) in self.enumerate_payloads():
+            if (not self.lidar_port or port == self.lidar_port) and len(payload) == self.lidar_packet_size:
+                yield (offset, client.LidarPacket(payload, self._metadata, timestamp))
+            elif (not self.imu_port or port == self.imu_port) and len(payload) == self.imu_packet_size:
+                yield (offset, client.ImuPacket(payload, self._metadata, timestamp))
+
+    def __iter__(self):
+        for (_, packet) in self.enumerate_packets():
+            yield packet
+
+    def close(self):
+        pass
@@ -2,13 +2,21 @@ from ouster import client, pcap
 from ouster.client.core import ClientTimeout
 import open3d as o3d
 from pcap.colormaps import colorize, normalize
+from pcap.frame import Frame
+from pcap.frameIndex import FrameIndex
+from pcap.indexedPcapSource import IndexedPcapSource
 from sbet.sbetParser import SbetParser
-from sbet.sbetRow import SbetRow
+from sbet.trajectory import Trajectory, TRAJECTORY_DTYPE
+from utils.atomicFile import atomic_write
+from utils.fileFingerprint import get_file_fingerprint
 import numpy as np
 import os
 import json
 from datetime import datetime
 
+# Increase this when the content of the cached metadata/coordinates changes, so that existing caches are rebuilt.
+CACHE_SCHEMA_VERSION = 2
+
 class PcapReader:
 
     def __init__(self, pcap_path, meta_data_path=None, skip_frames=0, args=None):
@@ -30,34 +38,88 @@ class PcapReader:
         
         self.xyzLut = client.XYZLut(self.metadata)
 
+        # The floating point type used for the points and colors of each frame (np.float32 with --float32). 
+        # The points are relative to the sensor, so float32 still gives sub-millimeter precision.
+        self.dtype = np.float32 if args is not None and getattr(args, "float32", False) else np.float64
+
+        # The projection table behind xyzLut, as (direction, offset) arrays per pixel, and the
+        # per-pixel range limits for a given max distance (see get_projection and get_range_limits).
+        self.projection = None
+        self.range_limits = None
+
         self.source = pcap.Pcap(pcap_path, self.metadata)
 
         self.channels = [c for c in client.ChanField.values]
 
         # If 0, every frame will be read. If 1, every second frame, etc.
         self.skip_frames = skip_frames
+
+        # If set, the frames are read from the end of the file to the start (see read_reversed_frames).
+        self.reverse = args is not None and getattr(args, "reverse", False)
+        self.reverse_chunk_frames = max(1, getattr(args, "reverse_chunk_frames", None) or 16) if args is not None else 16
         
+        # The internal metadata (frame count, time bounds) is cached as JSON, and the coordinates of every
+        # frame in a binary file next to it. Both are validated against fingerprints of the files
+        # and settings they were created from, and rebuilt automatically when they are stale.
         self.internal_meta_path = pcap_path.replace(".pcap", ".pcap.meta.json")
+        self.coordinates_path = pcap_path.replace(".pcap", ".pcap.coordinates.npy")
         self.internal_meta = {}
         recreate_caches = True if args is not None and args.recreate_caches else False
+        self.recreate_caches = recreate_caches
         if os.path.isfile(self.internal_meta_path) and not recreate_caches:
             try:
                 with open(self.internal_meta_path) as f:
-                    self.internal_meta = json.load(f)
-                    if "coordinates" in self.internal_meta:
-                        self.internal_meta["coordinates"] = [SbetRow(None, None, None, x) for x in self.internal_meta["coordinates"]]
+                    internal_meta = json.load(f)
+                if internal_meta.get("schema_version") == CACHE_SCHEMA_VERSION and internal_meta.get("pcap_fingerprint") == self.get_pcap_fingerprint():
+                    self.internal_meta = internal_meta
             except:
                 self.internal_meta = {}
 
+        # The frame index is loaded (or built) lazily the first time it is needed.
+        self.frame_index_path = pcap_path.replace(".pcap", ".pcap.index.npz")
+        self.frame_index = None
+
+        # The (unrotated) coordinates of every frame in the file, without skipping any frames.
         self.frame_coordinates = None
         self.sbet = None
+        self.gps_epoch = None
+        # If set, frame positions are interpolated between the SBET rows (see SbetParser.sample_poses).
+        self.sbet_interpolate = args is not None and getattr(args, "sbet_interpolate", False)
         self.skip_last_frame_in_pcap_file = False
+        # Extra point filters applied in next_frame, see add_frame_filter.
+        self.frame_filters = []
+
+        # The pixels of the range image that hit the vehicle (see get_vehicle_pixels). If neither a mask 
+        # file nor a number of frames to learn it from is given, the fixed vehicle box is used instead.
+        self.vehicle_pixels = None
+        self.vehicle_mask_path = pcap_path.replace(".pcap", ".pcap.vehicle-mask.npy")
+        self.vehicle_mask_given = False
+        self.vehicle_mask_frames = 0
+        # The shape of the range images, known after the first frame has been read.
+        self.frame_shape = None
+
+        # Decimation applied before the points are projected, see set_decimation.
+        self.beam_step = 1
+        self.column_step = 1
+        self.point_budget = None
+        self.decimation_pixels = None
         if args is not None:
             if getattr(args, "sbet", None) is not None:
-                self.sbet = SbetParser(args.sbet, args.sbet_noise, args.sbet_noise_from_frame_ix, args.sbet_crs_from, args.sbet_crs_to)
+                self.sbet = SbetParser.load(args.sbet, args.sbet_noise, args.sbet_noise_from_frame_ix, args.sbet_crs_from, args.sbet_crs_to)
                 self.gps_week = self.sbet.get_gps_week(pcap_path = self.pcap_path)
+                # Kept here rather than in the parser, since the parser may be shared with readers of other pcap files.
+                self.gps_epoch = self.sbet.get_gps_epoch(os.path.basename(self.pcap_path))
+
+                # Only read the part of the SBET file covered by this pcap file (if known already).
+                if "min_time_unix" in self.internal_meta and "max_time_unix" in self.internal_meta:
+                    self.sbet.ensure_window_unix(self.internal_meta["min_time_unix"], self.internal_meta["max_time_unix"], self.gps_week)
             if getattr(args, "skip_last_frame_in_pcap_file", False):
                 self.skip_last_frame_in_pcap_file = True
+            if getattr(args, "vehicle_mask", None) is not None:
+                self.vehicle_mask_path = args.vehicle_mask
+                self.vehicle_mask_given = True
+            self.vehicle_mask_frames = getattr(args, "vehicle_mask_frames", None) or 0
+            self.set_decimation(getattr(args, "beam_step", None) or 1, getattr(args, "column_step", None) or 1, getattr(args, "point_budget", None))
 
         self.reset()
 
@@ -66,26 +128,211 @@ class PcapReader:
 
     def count_frames(self, show_progress = False):
         if "frame_count" not in self.internal_meta:
-            if show_progress:
-                print("Counting frames ...")
-            return len(list(self.enumerate_lidar_packets()))
+            self.scan_metadata(show_progress)
         return self.internal_meta["frame_count"]
 
     def save_internal_meta(self):
-        with open(self.internal_meta_path, 'w') as f:
-            json.dump(self.internal_meta, f, default=vars)
+        self.internal_meta["schema_version"] = CACHE_SCHEMA_VERSION
+        self.internal_meta["pcap_fingerprint"] = self.get_pcap_fingerprint()
+        with atomic_write(self.internal_meta_path) as f:
+            json.dump(self.internal_meta, f, default=lambda x: vars(x))
+
+    def get_pcap_fingerprint(self):
+        return get_file_fingerprint(self.pcap_path)
+
+    def get_sbet_fingerprint(self):
+        """Returns everything the cached coordinates depend on, apart from the pcap file itself.
+        Random noise is not included, since it is never cached (see get_coordinates)."""
+
+        stat = os.stat(self.sbet.filename)
+        return {
+            "path": os.path.abspath(self.sbet.filename),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "crs_from": self.sbet.crs_from,
+            "crs_to": self.sbet.crs_to,
+            "gps_epoch": self.gps_epoch,
+            "interpolate": self.sbet_interpolate
+        }
+
+    def has_valid_caches(self):
+        """Returns True if the internal metadata, the frame index and (if an SBET file is given) the frame
+        coordinates are all cached and were created from the current files and settings, meaning that
+        scan_metadata would not have to recreate anything."""
+
+        if self.recreate_caches or "frame_count" not in self.internal_meta:
+            return False
+
+        if FrameIndex.load(self.frame_index_path, self.pcap_path) is None:
+            return False
+
+        if self.sbet is not None:
+            if self.internal_meta.get("coordinates_fingerprint") != self.get_sbet_fingerprint() or not os.path.isfile(self.coordinates_path):
+                return False
+
+        return True
+
+    def get_frame_index(self, show_progress=False):
+        """Returns the FrameIndex for this pcap file, loading it from disk or building it
+        (and saving it next to the pcap file) if necessary."""
+
+        if self.frame_index is not None:
+            return self.frame_index
+
+        if not self.recreate_caches:
+            self.frame_index = FrameIndex.load(self.frame_index_path, self.pcap_path)
+
+        if self.frame_index is None:
+            self.frame_index = FrameIndex.build(self.pcap_path, self.metadata, show_progress)
+            self.frame_index.save(self.frame_index_path)
+
+        return self.frame_index
+
+    def scan_metadata(self, show_progress=False):
+        """Fills the internal metadata (frame count, time bounds and, if an SBET file is given,
+        the coordinates of every frame) from a single streaming pass through the pcap file.
+        The pass builds the frame index, and everything else is derived from the per-frame 
+        timestamps in the index, so the pcap file is never decoded more than once."""
+
+        frames = self.get_frame_index(show_progress).frames
+
+        self.internal_meta["frame_count"] = len(frames)
+
+        if len(frames) > 0:
+            min_time = int(np.min(frames["first_time"]))
+            max_time = int(np.max(frames["last_time"]))
+
+            self.internal_meta["min_time_unix"] = min_time
+            self.internal_meta["max_time_unix"] = max_time
+            
+            self.internal_meta["min_time_human"] = datetime.utcfromtimestamp(min_time/1000000000).strftime("%Y-%m-%d %H:%M:%S")
+            self.internal_meta["max_time_human"] = datetime.utcfromtimestamp(max_time/1000000000).strftime("%Y-%m-%d %H:%M:%S")
+
+        self.save_internal_meta()
+
+        if self.sbet is not None:
+            self.get_frame_coordinates(show_progress)
+
+    def count_read_frames(self):
+        """Returns the number of frames next_frame returns from this file (after skipping frames), which is
+        the number of coordinates returned by get_coordinates."""
+        return len(self.get_read_raw_frames())
+
+    def get_read_raw_frames(self):
+        """Returns the (raw) indices of the frames that are read, in reading order. Reading forwards, the
+        skipped frames come before each kept frame (see skip_and_get and read_kept_frames). The last frame 
+        in a file is never read (it is often incomplete), so it is not included in either direction."""
+        if self.reverse:
+            return self.get_reversed_raw_frames()
+        return range(self.skip_frames, max(0, self.count_frames() - 1), self.skip_frames + 1)
+
+    def get_reversed_raw_frames(self):
+        """Returns the (raw) indices of the frames that are read in reverse mode, in reading order. Reading
+        starts at the second to last frame, since the last frame in a file is never read (it is often incomplete)."""
+        return range(self.count_frames() - 2, -1, -(self.skip_frames + 1))
 
     def reset(self):
-        self.source.reset()
-        self.scans = iter(client.Scans(self.source))
+        if self.reverse:
+            self.scans = self.read_reversed_frames(0)
+        elif self.skip_frames > 0:
+            self.scans = self.read_kept_frames(0)
+        else:
+            self.source.reset()
+            self.scans = iter(client.Scans(self.source))
         self.last_read_frame_ix = -1
         self.last_read_frame_ix_including_skips = -1
 
+    def read_kept_frames(self, raw_ix):
+        """Yields the scans of the frames that are not skipped, starting at the given (raw) frame index.
+        Only the byte ranges of these frames are read from the file, so the packets of skipped frames
+        are never read or assembled into scans. The frame index is loaded (or built) on the first call."""
+
+        index = self.get_frame_index()
+        ranges = [index.get_range(ix) for ix in range(raw_ix + self.skip_frames, len(index), self.skip_frames + 1)]
+
+        yield from client.Scans(IndexedPcapSource(self.pcap_path, self.metadata, ranges=ranges))
+
+    def read_reversed_frames(self, frame_index):
+        """Yields the scans of the frames in reverse order, starting at the given frame index (counted in
+        reading order, so 0 is the last frame that is read). Since packets can only be assembled into scans
+        forwards, the frames are read in chunks of reverse_chunk_frames consecutive (kept) frames using 
+        the byte ranges from the frame index, and each chunk is yielded backwards. At most one chunk of 
+        scans is kept in memory."""
+
+        index = self.get_frame_index()
+        raw_frames = self.get_reversed_raw_frames()[frame_index:]
+
+        for start in range(0, len(raw_frames), self.reverse_chunk_frames):
+            chunk = raw_frames[start:start + self.reverse_chunk_frames]
+            source = IndexedPcapSource(self.pcap_path, self.metadata, ranges=[index.get_range(ix) for ix in reversed(chunk)])
+            try:
+                scans = list(client.Scans(source))
+            finally:
+                source.close()
+
+            yield from reversed(scans)
+
+    def seek(self, frame_index):
+        """Moves the reader so that the next call to next_frame returns the frame with the
+        given index (the same index as returned by get_current_frame_index, meaning that
+        skipped frames are not counted). Uses the frame index to jump directly to the
+        correct location in the file instead of decoding all frames before it.
+        Returns False if the index is outside of the file."""
+
+        if self.reverse:
+            if frame_index < 0 or frame_index >= self.count_read_frames():
+                return False
+
+            self.scans = self.read_reversed_frames(frame_index)
+            self.last_read_frame_ix = frame_index - 1
+            self.last_read_frame_ix_including_skips = -1
+            return True
+
+        if frame_index < 0 or frame_index >= self.count_read_frames():
+            return False
+
+        # The first raw frame of the group (the skipped frames followed by the kept frame, get_read_raw_frames()[frame_index]).
+        index = self.get_frame_index()
+        raw_ix = frame_index * (self.skip_frames + 1)
+
+        if frame_index == 0:
+            self.reset()
+            return True
+
+        if self.skip_frames > 0:
+            self.scans = self.read_kept_frames(raw_ix)
+        else:
+            self.scans = iter(client.Scans(IndexedPcapSource(self.pcap_path, self.metadata, index.get_offset(raw_ix))))
+        self.last_read_frame_ix = frame_index - 1
+        self.last_read_frame_ix_including_skips = raw_ix - 1
+
+        return True
+
+    def seek_time(self, unix_ns):
+        """Moves the reader to the frame containing the given unix timestamp (in nanoseconds),
+        or the first frame after it. Returns the index of this frame."""
+
+        raw_ix = self.get_frame_index().find_time(unix_ns)
+        if self.reverse:
+            # In reverse, the first frame after the time in reading order is the last frame before it in the file.
+            frame_index = -(-(self.count_frames() - 2 - raw_ix) // (self.skip_frames + 1))
+        else:
+            # The first kept frame (raw index k * (skip_frames + 1) + skip_frames) at or after the raw index.
+            frame_index = -(-(raw_ix - self.skip_frames) // (self.skip_frames + 1))
+        frame_index = max(0, min(frame_index, self.count_read_frames() - 1))
+        self.seek(frame_index)
+        return frame_index
+
     def skip_and_get(self, iterator):
         try:
-            for _ in range(self.skip_frames):
-                self.last_read_frame_ix_including_skips += 1
-                next(iterator)
+            if self.reverse:
+                self.last_read_frame_ix += 1
+                raw_frames = self.get_reversed_raw_frames()
+                self.last_read_frame_ix_including_skips = raw_frames[self.last_read_frame_ix] if self.last_read_frame_ix < len(raw_frames) else -1
+                return next(iterator)
+
+            # The skipped frames are not in the iterator (see read_kept_frames), but they are still counted.
+            self.last_read_frame_ix_including_skips += self.skip_frames
             self.last_read_frame_ix += 1
             self.last_read_frame_ix_including_skips += 1
             
@@ -101,12 +348,21 @@ class PcapReader:
             return None
 
     def print_info(self, frame_index=None, printFunc=print):
-        """Print information about all the packets in this file."""
+        """Print information about all the packets in this file, or only the first packet of
+        the given frame (and the IMU packet following it)."""
 
         source = pcap.Pcap(self.pcap_path, self.metadata)
         ix = -1
         imu = -1
 
+        # Jump straight to the requested frame instead of reading through the whole file
+        if frame_index is not None:
+            index = self.get_frame_index()
+            if frame_index < 0 or frame_index >= len(index):
+                return
+            source = IndexedPcapSource(self.pcap_path, self.metadata, index.get_offset(frame_index))
+            ix = frame_index - 1
+
         for packet in source:
             if isinstance(packet, client.LidarPacket):
 
@@ -144,7 +400,7 @@ class PcapReader:
                 printFunc(f'  near_ir = {near_ir.shape}')
 
                 if self.sbet is not None:
-                    printFunc(self.sbet.get_position(self.get_sbet_timestamp(packet), gps_week=self.gps_week))
+                    printFunc(self.sbet.get_position(self.get_sbet_timestamp(packet), gps_week=self.gps_week, gps_epoch=self.gps_epoch))
 
             elif isinstance(packet, client.ImuPacket):
 
@@ -165,76 +421,71 @@ class PcapReader:
                 if frame_index is not None:
                     break
 
-    def enumerate_lidar_packets(self):
-        count = 0
-        min_time = 9223372036854775807
-        max_time = -9223372036854775807
-        find_bounds = "min_time_unix" not in self.internal_meta
-        find_count = "frame_count" not in self.internal_meta
+    def get_sbet_data(self):
+        return {
+            "crs_from": self.sbet.crs_from,
+            "crs_to": self.sbet.crs_to,
+            "gps_epoch": self.gps_epoch,
+            "interpolate": self.sbet_interpolate
+        }
 
-        source = pcap.Pcap(self.pcap_path, self.metadata)
-        last_frame_id = -1
-        for packet in source:
-            if isinstance(packet, client.LidarPacket):
-                frame_id = packet.header(client.ColHeader.FRAME_ID)[0]
-                
-                if find_bounds:
-                    timestamps = packet.header(client.ColHeader.TIMESTAMP)
-                    min_time = min(min_time, timestamps[0])
-                    max_time = max(max_time, timestamps[1])
+    def get_frame_coordinates(self, show_progress=False):
+        """Returns a Trajectory with the coordinates of every frame in the file (ignoring skip_frames and
+        random noise), loading it from the cache (memory-mapped) or creating and caching it if the
+        cache is missing or was created from other files or settings."""
 
-                if frame_id != last_frame_id:
-                    count += 1
-                    last_frame_id = frame_id
+        if self.frame_coordinates is not None:
+            return self.frame_coordinates
 
-                    yield packet
+        fingerprint = self.get_sbet_fingerprint()
 
-        self.internal_meta["frame_count"] = count
-        if find_bounds:
+        if not self.recreate_caches and self.internal_meta.get("coordinates_fingerprint") == fingerprint and os.path.isfile(self.coordinates_path):
+            try:
+                data = np.load(self.coordinates_path, mmap_mode="r")
+                if data.dtype == TRAJECTORY_DTYPE and len(data) == self.internal_meta.get("frame_count"):
+                    self.frame_coordinates = Trajectory(data)
+            except:
+                self.frame_coordinates = None
 
-            self.internal_meta["min_time_unix"] = int(min_time)
-            self.internal_meta["max_time_unix"] = int(max_time)
-            
-            self.internal_meta["min_time_human"] = datetime.utcfromtimestamp(min_time/1000000000).strftime("%Y-%m-%d %H:%M:%S")
-            self.internal_meta["max_time_human"] = datetime.utcfromtimestamp(max_time/1000000000).strftime("%Y-%m-%d %H:%M:%S")
+        if self.frame_coordinates is None:
+
+            # The timestamps of every frame are already available from the frame index, 
+            # so there is no need to read through the pcap file again.
+            timestamps = self.get_frame_index(show_progress).frames["sbet_time"]
 
-        if find_bounds or find_count:
+            self.frame_coordinates = self.sbet.get_positions(timestamps, pcap_path=self.pcap_path, gps_week=self.gps_week, add_noise=False, interpolate=self.sbet_interpolate, gps_epoch=self.gps_epoch)
+
+            with atomic_write(self.coordinates_path, "wb") as f:
+                np.save(f, self.frame_coordinates.data)
+            self.internal_meta["coordinates_fingerprint"] = fingerprint
             self.save_internal_meta()
 
-    def get_sbet_data(self):
-        return {
-            "crs_from": self.sbet.crs_from,
-            "crs_to": self.sbet.crs_to,
-            "gps_epoch": self.sbet.gps_epoch
-        }
+        return self.frame_coordinates
 
     def get_coordinates(self, rotate=True, show_progress=False):
-        """Returns a list of coordinates (SbetRow) corresponding to each LidarPacket in the current Pcap file."""
-
-        if "coordinates" in self.internal_meta:
-            return self.internal_meta["coordinates"]
+        """Returns a Trajectory with the coordinates corresponding to each frame in the current Pcap file
+        (after skipping frames). The returned trajectory is a copy, so it can be modified without
+        affecting the cache. Random noise is added to the copy if configured."""
 
         if self.sbet is None:
             return None
 
-        positions = []
-        self.sbet.reset()
-        iterator = iter(self.enumerate_lidar_packets())
-        for packet in iterator:
-            pos = self.sbet.get_position(self.get_sbet_timestamp(packet), pcap_path=self.pcap_path, gps_week=self.gps_week, continue_from_previous=True, frame_ix=len(positions))
-            positions.append(pos)
-
-            for _ in range(self.skip_frames):
-                next(iterator, None)
+        # In reading order, and only for the frames next_frame returns, so that get_current_frame_index 
+        # gives the coordinate of the current frame (also across the files in a SerialPcapReader).
+        positions = Trajectory(self.get_frame_coordinates(show_progress).data[np.asarray(self.get_read_raw_frames(), dtype=np.int64)])
+        self.sbet.apply_noise(positions)
 
         if rotate:
-            positions = SbetParser.rotate_points(positions, positions[0].heading - np.pi / 2)
-
-        self.internal_meta["coordinates"] = positions
-        self.save_internal_meta()
+            positions.rotate_points(positions[0].heading - np.pi / 2)
 
         return positions
 
+    def get_column_poses(self, scan):
+        """Returns a Trajectory with the interpolated (unrotated, noise free) pose at the timestamp of every
+        column in the given scan, for example for correcting the motion of the vehicle during a frame."""
+
+        return self.sbet.get_positions(self.get_column_timestamps(scan), pcap_path=self.pcap_path, gps_week=self.gps_week, add_noise=False, interpolate=True, gps_epoch=self.gps_epoch)
+
     def get_current_frame_index(self):
         return self.last_read_frame_ix
 
@@ -251,41 +502,257 @@ class PcapReader:
         # There is a very slight difference, but using the final timestamp seems to give the best position.
         return timestamps[-1]
 
-    def remove_vehicle(self, frame, cloud = None):
+    def get_projection(self, shape):
+        """Returns (direction, offset) arrays with one row per pixel (in the order of a flattened range
+        image), such that xyzLut projects a pixel with range r > 0 to direction * r + offset. Since 
+        the SDK does not expose the table itself, it is derived once from the projection of two 
+        constant range images (the projection is linear in the range)."""
+
+        if self.projection is None:
+            r = 1 << 16
+            xyz1 = self.xyzLut(np.full(shape, r, dtype=np.uint32)).reshape((-1, 3))
+            xyz2 = self.xyzLut(np.full(shape, 2 * r, dtype=np.uint32)).reshape((-1, 3))
+            direction = (xyz2 - xyz1) / r
+            offset = xyz1 - direction * r
+            self.projection = (direction.astype(self.dtype), offset.astype(self.dtype))
+
+        return self.projection
+
+    def project(self, ranges, pixels):
+        """Projects the given pixels (indices into the flattened range image) to xyz, giving the same 
+        points as xyzLut would for those pixels. Pixels with range 0 are projected to the origin."""
+
+        (direction, offset) = self.get_projection(ranges.shape)
+        r = ranges.reshape(-1)[pixels].astype(self.dtype)
+        xyz = direction[pixels] * r[:, None]
+        xyz += offset[pixels] * (r != 0)[:, None]
+        return xyz
+
+    def get_range_limits(self, shape, max_distance):
+        """Returns the largest raw range value per pixel that can possibly be within max_distance
+        of the sensor origin, taking the beam offset of each pixel into account."""
+
+        if self.range_limits is None or self.range_limits[0] != max_distance:
+            (direction, offset) = self.get_projection(shape)
+            limits = (max_distance + np.linalg.norm(offset, axis=1)) / np.linalg.norm(direction, axis=1)
+            self.range_limits = (max_distance, np.floor(limits).astype(np.uint32) + 1)
+
+        return self.range_limits[1]
+
+    def set_decimation(self, beam_step=1, column_step=1, point_budget=None):
+        """Makes next_frame only keep every beam_step-th beam (row) and every column_step-th column of
+        the range image, and at most point_budget points (picked evenly across the remaining pixels). 
+        The decimation is applied before the points are projected. The point budget is applied after
+        the range and vehicle pixel prefilter (see get_range_candidates), so it counts candidate points."""
+
+        self.beam_step = max(1, beam_step)
+        self.column_step = max(1, column_step)
+        self.point_budget = point_budget if point_budget is not None and point_budget > 0 else None
+        self.decimation_pixels = None
+
+    def get_decimation_pixels(self, shape):
+        """Returns a boolean image (with the given shape) of the pixels kept by the beam and column steps, 
+        or None if every pixel is kept."""
+
+        if self.beam_step == 1 and self.column_step == 1:
+            return None
+
+        if self.decimation_pixels is None or self.decimation_pixels.shape != tuple(shape):
+            self.decimation_pixels = np.zeros(shape, dtype=bool)
+            self.decimation_pixels[::self.beam_step, ::self.column_step] = True
+
+        return self.decimation_pixels
+
+    def apply_point_budget(self, pixels):
+        if self.point_budget is None or len(pixels) <= self.point_budget:
+            return pixels
+        return pixels[np.linspace(0, len(pixels) - 1, self.point_budget).astype(np.int64)]
+
+    def get_range_candidates(self, ranges, max_distance=None, excluded_pixels=None, included_pixels=None):
+        """Returns the indices (into the flattened range image) of all pixels with a valid return that
+        can be within max_distance, are not excluded and are included (if given). This is a conservative 
+        integer test on the raw range values; the exact filtering is done on the projected points by 
+        get_frame_mask."""
+
+        flat = ranges.reshape(-1)
+        candidates = flat != 0
+
+        if max_distance is not None:
+            candidates &= flat <= self.get_range_limits(ranges.shape, max_distance)
+
+        if excluded_pixels is not None:
+            candidates &= ~excluded_pixels.reshape(-1)
+
+        if included_pixels is not None:
+            candidates &= included_pixels.reshape(-1)
+
+        return np.flatnonzero(candidates)
+
+    def get_vehicle_pixels(self, shape):
+        """Returns a boolean image (with the given shape) of the pixels that hit the vehicle, or None 
+        if the vehicle box should be used instead. The mask is loaded from the given mask file, or 
+        from the cached mask next to the pcap file, or learned from the first frames in the file."""
+
+        if self.vehicle_pixels is not None:
+            return self.vehicle_pixels
+
+        if not self.vehicle_mask_given and self.vehicle_mask_frames <= 0:
+            return None
+
+        if os.path.isfile(self.vehicle_mask_path) and (self.vehicle_mask_given or not self.recreate_caches):
+            vehicle_pixels = np.load(self.vehicle_mask_path)
+            if vehicle_pixels.shape == tuple(shape):
+                self.vehicle_pixels = vehicle_pixels.astype(bool)
+                return self.vehicle_pixels
+            if self.vehicle_mask_given:
+                raise Exception(f"The vehicle mask {self.vehicle_mask_path} has the shape {vehicle_pixels.shape}, but the frames have the shape {tuple(shape)}.")
+
+        if self.vehicle_mask_given:
+            raise Exception(f"The vehicle mask {self.vehicle_mask_path} does not exist.")
+
+        self.vehicle_pixels = self.learn_vehicle_pixels(self.vehicle_mask_frames)
+        with atomic_write(self.vehicle_mask_path, "wb") as f:
+            np.save(f, self.vehicle_pixels)
+
+        return self.vehicle_pixels
+
+    def learn_vehicle_pixels(self, frame_count):
+        """Finds the pixels that hit the vehicle by checking where the vehicle box is hit in the first
+        frame_count frames in the file. Since the vehicle is rigidly attached to the sensor, the same
+        pixels hit it in every frame. A pixel is marked as vehicle if at least half of its returns
+        were inside the box."""
+
+        source = IndexedPcapSource(self.pcap_path, self.metadata)
+        inside = None
+        returns = None
+
+        try:
+            for (ix, scan) in enumerate(client.Scans(source)):
+                if ix >= frame_count:
+                    break
+
+                ranges = scan.field(client.ChanField.RANGE)
+                valid = ranges.reshape(-1) != 0
+                xyz = self.project(ranges, np.arange(ranges.size))
+
+                if inside is None:
+                    inside = np.zeros(ranges.size, dtype=np.int32)
+                    returns = np.zeros(ranges.size, dtype=np.int32)
+
+                inside += valid & ~self.get_vehicle_mask(xyz)
+                returns += valid
+        finally:
+            source.close()
+
+        if inside is None:
+            raise Exception(f"Could not learn the vehicle mask, since {self.pcap_path} has no frames.")
+
+        return ((inside > 0) & (inside * 2 >= returns)).reshape(ranges.shape)
+
+    def add_frame_filter(self, predicate):
+        """Adds an extra filter to every frame returned by next_frame. The predicate receives the
+        (N, 3) xyz array of a frame, and must return a boolean array where True means keep the point."""
+        self.frame_filters.append(predicate)
+
+    def get_vehicle_mask(self, frame):
         # Remove the vehicle, which is always stationary at the center. We don't want that
         # to interfere with the point cloud alignment.
 
+        vw = 0.7
+        vl = 2.2
+        x = frame[:, 0]
+        y = frame[:, 1]
+        z = frame[:, 2]
+
+        mask = x > 0.2
+        mask |= x < -vl
+        mask |= y > vw
+        mask |= y < -vw
+        mask |= z > 0.3
+        mask |= z < -2
+        return mask
+
+    def get_valid_mask(self, frame):
+        mask = frame[:, 0] != 0
+        mask &= frame[:, 1] != 0
+        mask &= frame[:, 2] != 0
+        return mask
+
+    def get_distance_mask(self, meters, frame):
+        # Compare squared distances, to avoid a square root for every point.
+        return np.einsum("ij,ij->i", frame, frame) <= meters * meters
+
+    def get_frame_mask(self, frame, remove_vehicle=False, max_distance=None):
+        """Returns a single boolean mask with the points to keep in the given (N, 3) frame, combining
+        vehicle removal (or removal of invalid points), the max distance and any extra frame filters."""
+
+        mask = self.get_vehicle_mask(frame) if remove_vehicle else self.get_valid_mask(frame)
+
+        if max_distance is not None:
+            mask &= self.get_distance_mask(max_distance, frame)
+
+        for predicate in self.frame_filters:
+            mask &= predicate(frame)
+
+        return mask
+
+    def remove_vehicle(self, frame, cloud = None):
         if cloud is None:
             cloud = frame
 
-        vw = 0.7
-        vl = 2.2
-        return cloud[((frame[:, 0] > 0.2) | (frame[:, 0] < -vl)) | ((frame[:, 1] > vw) | (frame[:, 1] < -vw)) | ((frame[:, 2] > 0.3) | (frame[:, 2] < -2))]
+        return cloud[self.get_vehicle_mask(frame)]
 
     def remove_invalid(self, frame, cloud = None):
-        # Remove the vehicle, which is always stationary at the center. We don't want that
-        # to interfere with the point cloud alignment.
-
         if cloud is None:
             cloud = frame
 
-        return cloud[(frame[:, 0] != 0) & (frame[:, 1] != 0) & (frame[:, 2] != 0)]
+        return cloud[self.get_valid_mask(frame)]
 
     def remove_outside_distance(self, meters, frame, cloud = None):
-        # Remove the vehicle, which is always stationary at the center. We don't want that
-        # to interfere with the point cloud alignment.
-
         if cloud is None:
             cloud = frame
 
-        return cloud[np.sqrt(frame[:,0]**2+frame[:,1]**2+frame[:,2]**2) <= meters]
+        return cloud[self.get_distance_mask(meters, frame)]
+
+    def get_column_timestamps(self, scan):
+        timestamps = getattr(scan, "timestamp", None)
+        return timestamps if timestamps is not None else scan.header(client.ColHeader.TIMESTAMP)
 
-    def next_frame(self, remove_vehicle:bool=False, timer=None, colored=True, max_distance=None):
-        """Retrieves the next frame"""
+    def filter_frame(self, frame, remove_vehicle:bool=False, max_distance=None, colored=True):
+        """Applies vehicle removal, the max distance and colorization to a raw frame (read with
+        next_frame(raw=True)), and returns the filtered frame. This gives the same points and colors as 
+        reading the frame with these settings, so the settings can be changed without decoding the frame again.
+        The colors are created here, from the normalized reflectivity kept in the raw frame (Frame.key)."""
 
         if max_distance is None:
             max_distance = self.max_distance
 
+        vehicle_pixels = self.get_vehicle_pixels(self.frame_shape) if remove_vehicle else None
+        mask = self.get_frame_mask(frame.xyz, remove_vehicle and vehicle_pixels is None, max_distance)
+
+        if vehicle_pixels is not None:
+            mask &= ~vehicle_pixels[frame.ring, frame.column]
+
+        frame = frame.select(mask)
+        if colored and frame.key is not None:
+            frame.colors = colorize(frame.key.reshape((-1, 1)), self.dtype).reshape((-1, 3))
+        elif not colored:
+            frame.colors = None
+
+        return frame
+
+    def next_frame(self, remove_vehicle:bool=False, timer=None, colored=True, max_distance=None, as_frame=False, raw=False):
+        """Retrieves the next frame, as an Open3D point cloud, or as a Frame (with NumPy columns
+        for the points and their attributes) if as_frame is True. If raw is True, only invalid points
+        are removed (no vehicle removal or max distance), no colors are created, and the frame can be 
+        filtered and colored later with filter_frame."""
+
+        if raw:
+            remove_vehicle = False
+            colored = False
+        elif max_distance is None:
+            max_distance = self.max_distance
+
         if timer is not None: timer.reset()
 
         scan = self.skip_and_get(self.scans)
@@ -295,55 +762,77 @@ class PcapReader:
         if scan is None:
             return None
 
-        if self.last_read_frame_ix_including_skips >= self.internal_meta["frame_count"] - 1:
+        if not self.reverse and self.last_read_frame_ix_including_skips >= self.count_frames() - 1:
             return None
-            
-        # Prepare the frame for visualization
-        xyz = self.xyzLut(scan)
-        xyz = xyz.reshape((-1, 3))
 
-        if timer is not None: timer.time("frame reshaping")
+        # Discard invalid pixels and pixels that are certainly too far away directly in the range 
+        # image, and only project the remaining pixels.
+        # With a vehicle pixel mask, the vehicle pixels are removed here as well, and the vehicle box is not used.
+        ranges = scan.field(client.ChanField.RANGE)
+        self.frame_shape = ranges.shape
+        vehicle_pixels = self.get_vehicle_pixels(ranges.shape) if remove_vehicle else None
+        pixels = self.get_range_candidates(ranges, max_distance, vehicle_pixels, self.get_decimation_pixels(ranges.shape))
+        pixels = self.apply_point_budget(pixels)
+        xyz = self.project(ranges, pixels)
 
-        if colored:
+        if timer is not None: timer.time("frame projection")
+
+        # All filters are combined into one mask, which is applied once to every point attribute.
+        mask = self.get_frame_mask(xyz, remove_vehicle and vehicle_pixels is None, max_distance)
+        xyz = xyz[mask]
+        pixels = pixels[mask]
+
+        if timer is not None: timer.time("frame filtering")
+
+        if colored or raw:
             key = scan.field(self.channels[4]) # Channel REFLECTIVITY
 
-            # apply colormap to field values
-            key_img = normalize(key)
-            color_img = colorize(key_img)
+            # apply colormap to field values (the normalization uses the whole frame, 
+            # but only the points that are kept are colorized)
+            key_img = normalize(key, dtype=self.dtype).reshape(-1)[pixels]
+
+        if colored:
+            color_img = colorize(key_img.reshape((-1, 1)), self.dtype)
             color_img = color_img.reshape((-1, 3))
 
             if timer is not None: timer.time("frame colorization")
 
-        if remove_vehicle:
-            if colored:
-                color_img = self.remove_vehicle(xyz, color_img)
-            xyz = self.remove_vehicle(xyz)
-            if timer is not None: timer.time("frame vehicle removal")
-        else:
-            if colored:
-                color_img = self.remove_invalid(xyz, color_img)
-            xyz = self.remove_invalid(xyz)
-            if timer is not None: timer.time("frame invalid values removal")
+        frame = Frame(xyz, color_img if colored else None)
 
-        if max_distance is not None:
-            if colored:
-                color_img = self.remove_outside_distance(max_distance, xyz, color_img)
-            xyz = self.remove_outside_distance(max_distance, xyz)
-            if timer is not None: timer.time("frame max distance removal")
+        # Raw frames keep the normalized key instead of the colors, and are colored by filter_frame.
+        if raw:
+            frame.key = key_img
 
-        cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(xyz))
-        if colored:
-            cloud.colors = o3d.utility.Vector3dVector(color_img)
+        if as_frame:
+            width = ranges.shape[1]
+            frame.reflectivity = scan.field(client.ChanField.REFLECTIVITY).reshape(-1)[pixels]
+            frame.signal = scan.field(client.ChanField.SIGNAL).reshape(-1)[pixels]
+            frame.ring = (pixels // width).astype(np.uint16)
+            frame.column = (pixels % width).astype(np.uint16)
+
+            # Stored as offsets from the start of the frame, since a frame only spans about 100 ms. Columns
+            # without data have the timestamp 0, but no points.
+            timestamps = np.asarray(self.get_column_timestamps(scan), dtype=np.int64)
+            valid_timestamps = timestamps[timestamps > 0]
+            frame.start_time = int(valid_timestamps.min()) if len(valid_timestamps) > 0 else 0
+            frame.timestamp = np.maximum(timestamps[frame.column] - frame.start_time, 0).astype(np.uint32)
+
+            if timer is not None: timer.time("frame attribute extraction")
+
+            return frame
+
+        # Open3D's legacy point clouds are always float64, so this is where float32 frames are converted.
+        cloud = frame.to_legacy()
 
         if timer is not None: timer.time("frame cloud generation")
 
         return cloud
 
-    def read_all_frames(self, remove_vehicle:bool=False):
+    def read_all_frames(self, remove_vehicle:bool=False, as_frame=False):
 
         frames = []
         while True:
-            frame = self.next_frame(remove_vehicle)
+            frame = self.next_frame(remove_vehicle, as_frame=as_frame)
             if frame is None:
                 return frames
             frames.append(frame)
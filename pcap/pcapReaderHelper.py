@@ -3,6 +3,7 @@ import argparse
 
 from pcap.pcapReader import PcapReader
 from pcap.serialPcapReader import SerialPcapReader
+from pcap.prefetchingPcapReader import PrefetchingPcapReader
 
 class PcapReaderHelper:
 
@@ -29,7 +30,8 @@ class PcapReaderHelper:
             return
 
         parser.add_argument('--sbet', type=str, required=True, help="The path to a corresponding SBET file with GNSS coordinates.")
-        parser.add_argument('--sbet-noise', type=float, nargs=3, required=False, help="If given, all SBET coordinates will be randomized by adding a random value between +/- this value to the X, Y and Z coordinates. A value must be provided for each dimension (three values). This should be used together with --recreate-caches, otherwise any cached coordinates will be loaded and override the randomization.")
+        parser.add_argument('--sbet-noise', type=float, nargs=3, required=False, help="If given, all SBET coordinates will be randomized by adding a random value between +/- this value to the X, Y and Z coordinates. A value must be provided for each dimension (three values). The noise is not cached, so new random values are drawn every time the coordinates are loaded.")
+        parser.add_argument('--sbet-interpolate', action='store_true', help="If set, the position of each frame is interpolated between the SBET rows before and after the frame time (with slerp for roll/pitch/heading), instead of using the last SBET row before the frame time.")
         parser.add_argument('--sbet-noise-from-frame-ix', type=int, default=0, required=False, help="If SBET noise is activated, the noise will start from this frame index (frames before this index will use the actual unchanged coordinates).")
 
     @staticmethod
@@ -38,6 +40,15 @@ class PcapReaderHelper:
         parser.add_argument('--json', type=str, nargs='+', required=False, help="The path to corresponding JSON file(s) for each of the PCAP file(s) with the sensor metadata, relative or absolute. If this is not given, the PCAP location is used (by replacing .pcap with .json). A path to a directory containing multiple json files can also be provided.")
         parser.add_argument('--max-frame-radius', type=float, default=None, required=False, help="If given as a number larger than 0, all PCAP frames will be reduced in size by removing all points that are further away from the origin than this value (measured in meters).")
         parser.add_argument('--recreate-caches', action='store_true')
+        parser.add_argument('--float32', action='store_true', help="If set, frames (and the reference point cloud in absolute navigation) are processed as 32-bit floats instead of 64-bit floats, which halves the memory traffic. Coordinates are kept relative to a local offset, so the precision is preserved.")
+        parser.add_argument('--beam-step', type=int, default=1, required=False, help="If given a number larger than 1, only every n-th beam (row of the range image) is kept in each frame. The decimation is done before the points are projected, which makes it much cheaper than downsampling the point cloud.")
+        parser.add_argument('--column-step', type=int, default=1, required=False, help="If given a number larger than 1, only every n-th column (azimuth step) of the range image is kept in each frame.")
+        parser.add_argument('--point-budget', type=int, default=None, required=False, help="If given, at most this many points are kept in each frame (after removing pixels without a return, out of range or hitting the vehicle, but before the exact distance filtering of the projected points), picked evenly across the remaining pixels of the range image.")
+        parser.add_argument('--vehicle-mask-frames', type=int, default=0, required=False, help="If given a number larger than 0, the pixels of the range image that hit the vehicle are learned from this many frames at the start of each PCAP file (and cached next to it), and removed before the points are projected, instead of removing the points inside a fixed box around the vehicle.")
+        parser.add_argument('--vehicle-mask', type=str, default=None, required=False, help="The path to a vehicle pixel mask (.npy file with one boolean per pixel, as created by --vehicle-mask-frames) to use for removing the vehicle, instead of the fixed box around the vehicle.")
+        parser.add_argument('--reverse', action='store_true', help="If set, the PCAP file(s) are read backwards, from the last frame of the last file to the first frame of the first file. Frame indices and coordinates are counted in reading order.")
+        parser.add_argument('--reverse-chunk-frames', type=int, default=16, required=False, help="When reading backwards (--reverse), frames are decoded forwards in chunks of this many frames, which are then returned in reverse order. Larger chunks mean fewer seeks, but more memory.")
+        parser.add_argument('--prefetch-frames', type=int, default=0, required=False, help="If given a number larger than 0, frames will be read, filtered and converted on a background thread, keeping up to this many frames ready ahead of the navigation (so that frame decoding overlaps with registration).")
 
         PcapReaderHelper.add_sbet_arguments(parser, browsing_only)
 
@@ -86,6 +97,12 @@ class PcapReaderHelper:
             raise Exception("Found no PCAP files in the given location(s).")
 
         if len(pcaps) == 1:
-            return PcapReader(pcaps[0], jsons[0], skip_frames, args=args)
+            reader = PcapReader(pcaps[0], jsons[0], skip_frames, args=args)
         else:
-            return SerialPcapReader(pcaps, jsons, skip_frames, args=args)
\ No newline at end of file
+            reader = SerialPcapReader(pcaps, jsons, skip_frames, args=args)
+
+        prefetch_frames = getattr(args, "prefetch_frames", 0) if args is not None else 0
+        if prefetch_frames is not None and prefetch_frames > 0:
+            reader = PrefetchingPcapReader(reader, prefetch_frames)
+
+        return reader
\ No newline at end of file
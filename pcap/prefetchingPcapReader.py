@@ -0,0 +1,174 @@
+import threading
+import queue
+
+class PrefetchingPcapReader:
+    """Wraps a PcapReader or SerialPcapReader, and reads, filters and converts frames on a
+    background thread, so that frame decoding overlaps with whatever the consumer is doing
+    (typically registration). Up to prefetch_frames ready frames are kept in a queue.
+
+    The wrapper has the same next_frame/get_current_frame_index contract as the wrapped reader:
+    the frame index, file and "first frame in file" status reported by the wrapper always
+    correspond to the last frame returned by next_frame, not the last frame decoded by the
+    background thread. Everything else is passed through to the wrapped reader.
+    """
+
+    def __init__(self, reader, prefetch_frames=4):
+        self.reader = reader
+        self.prefetch_frames = max(1, prefetch_frames)
+
+        self.thread = None
+        self.frames = None
+        self.stop_event = None
+        self.frame_arguments = None
+
+        self.hits = 0
+        self.misses = 0
+
+        self._set_consumed_state(-1)
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not defined on the wrapper itself.
+        if name == "reader":
+            raise AttributeError(name)
+        return getattr(self.reader, name)
+
+    def _set_consumed_state(self, frame_ix, frame_ix_including_skips=-1, is_first_frame_in_file=False, pcap_path=None):
+        self.last_read_frame_ix = frame_ix
+        self.last_read_frame_ix_including_skips = frame_ix_including_skips
+        self.first_frame_in_file = is_first_frame_in_file
+        self.pcap_path = pcap_path if pcap_path is not None else self.reader.get_pcap_path()
+        self.is_exhausted = False
+
+    def _produce(self, frames, stop_event, remove_vehicle, colored, max_distance, as_frame):
+        """Runs on the background thread until the end of the file(s), or until stopped."""
+
+        while not stop_event.is_set():
+            try:
+                frame = self.reader.next_frame(remove_vehicle, None, colored, max_distance, as_frame)
+                if frame is None:
+                    item = None
+                else:
+                    item = {
+                        "frame": frame,
+                        "frame_ix": self.reader.get_current_frame_index(),
+                        "frame_ix_including_skips": getattr(self.reader, "last_read_frame_ix_including_skips", -1),
+                        "is_first_frame_in_file": self.reader.is_first_frame_in_file(),
+                        "pcap_path": self.reader.get_pcap_path()
+                    }
+            except Exception as e:
+                # Pass the exception on to the consumer, which will re-raise it.
+                item = e
+
+            # Wait for room in the queue, but give up if we are stopped in the meantime.
+            while not stop_event.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            if item is None or isinstance(item, Exception):
+                return
+
+    def _start(self, remove_vehicle, colored, max_distance, as_frame):
+        self.frame_arguments = (remove_vehicle, colored, max_distance, as_frame)
+        self.frames = queue.Queue(maxsize=self.prefetch_frames)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(self.frames, self.stop_event, remove_vehicle, colored, max_distance, as_frame), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background thread and throws away all prefetched frames. The wrapped reader
+        will be positioned somewhere after the last consumed frame."""
+
+        if self.thread is None:
+            return
+
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.frames = None
+        self.frame_arguments = None
+
+    def reset(self):
+        self.stop()
+        self.reader.reset()
+        self._set_consumed_state(-1)
+
+    def seek(self, frame_index):
+        self.stop()
+        result = self.reader.seek(frame_index)
+        self._set_consumed_state(frame_index - 1)
+        return result
+
+    def seek_time(self, unix_ns):
+        self.stop()
+        frame_index = self.reader.seek_time(unix_ns)
+        self._set_consumed_state(frame_index - 1)
+        return frame_index
+
+    def next_frame(self, remove_vehicle:bool=False, timer=None, colored=True, max_distance=None, as_frame=False):
+        """Retrieves the next frame from the prefetch queue."""
+
+        if timer is not None: timer.reset()
+
+        if self.is_exhausted:
+            return None
+
+        # If the frame arguments have changed, the prefetched frames are useless. Throw
+        # them away, and restart the background thread after the last consumed frame.
+        if self.thread is not None and self.frame_arguments != (remove_vehicle, colored, max_distance, as_frame):
+            self.stop()
+            self.reader.seek(self.last_read_frame_ix + 1)
+
+        if self.thread is None:
+            self._start(remove_vehicle, colored, max_distance, as_frame)
+
+        if self.frames.empty():
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        item = self.frames.get()
+
+        if timer is not None: timer.time("frame retrieval (waiting for prefetch)")
+
+        if isinstance(item, Exception):
+            self.stop()
+            raise item
+
+        if item is None:
+            self.stop()
+            self.is_exhausted = True
+            return None
+
+        self.last_read_frame_ix = item["frame_ix"]
+        self.last_read_frame_ix_including_skips = item["frame_ix_including_skips"]
+        self.first_frame_in_file = item["is_first_frame_in_file"]
+        self.pcap_path = item["pcap_path"]
+
+        return item["frame"]
+
+    def read_all_frames(self, remove_vehicle:bool=False, as_frame=False):
+
+        frames = []
+        while True:
+            frame = self.next_frame(remove_vehicle, as_frame=as_frame)
+            if frame is None:
+                return frames
+            frames.append(frame)
+
+    def get_current_frame_index(self):
+        return self.last_read_frame_ix
+
+    def get_current_frame_index_including_skips(self):
+        return self.last_read_frame_ix_including_skips
+
+    def is_first_frame_in_file(self):
+        return self.first_frame_in_file
+
+    def get_pcap_path(self):
+        return self.pcap_path
+
+    def get_prefetch_statistics(self):
+        return { "hits": self.hits, "misses": self.misses }
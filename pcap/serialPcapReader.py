@@ -1,12 +1,18 @@
 from pcap.pcapReader import PcapReader
 from tqdm import tqdm
-from sbet.sbetParser import SbetParser
+from sbet.trajectory import Trajectory
 import numpy as np
 
 class SerialPcapReader:
 
     def __init__(self, pcap_paths, meta_data_paths, skip_frames=0, args=None):
         self.readers = [PcapReader(x[0], x[1], skip_frames, args=args) for x in zip(pcap_paths, meta_data_paths)]
+
+        # In reverse mode, every reader reads its file backwards, and the files are read from the last
+        # to the first. The readers are kept in reading order, so that frame indices (and the coordinates
+        # from get_coordinates) are counted in reading order in both directions.
+        if args is not None and getattr(args, "reverse", False):
+            self.readers.reverse()
         self.current_reader_index = 0
         self._set_metadata()
 
@@ -19,6 +25,51 @@ class SerialPcapReader:
         self.current_reader_index = 0
         self._set_metadata()
 
+    def seek(self, frame_index):
+        """Moves to the given frame index (counted across all files), so that the next call to
+        next_frame returns this frame. Returns False if the index is outside of the files."""
+
+        first_ix = 0
+        for (ix, reader) in enumerate(self.readers):
+            count = reader.count_read_frames()
+            if frame_index < first_ix + count:
+
+                # Readers after this one may have been read from already, so rewind them.
+                for later in self.readers[ix + 1:]:
+                    later.reset()
+
+                self.current_reader_index = ix
+                self._set_metadata()
+                return reader.seek(frame_index - first_ix)
+
+            first_ix += count
+
+        return False
+
+    def seek_time(self, unix_ns):
+        """Moves to the frame containing the given unix timestamp (in nanoseconds), or the first frame 
+        after it in reading order. Returns the index of this frame (counted across all files)."""
+
+        first_ix = 0
+        for (ix, reader) in enumerate(self.readers):
+            frames = reader.get_frame_index().frames
+
+            # In reverse, the files are read from the last to the first, so the file to use is the first
+            # one (in reading order) that starts before the time, instead of the first one ending after it.
+            if len(frames) > 0 and (frames["first_time"][0] <= unix_ns if reader.reverse else frames["last_time"][-1] >= unix_ns):
+
+                # Readers after this one may have been read from already, so rewind them.
+                for later in self.readers[ix + 1:]:
+                    later.reset()
+
+                self.current_reader_index = ix
+                self._set_metadata()
+                return first_ix + reader.seek_time(unix_ns)
+
+            first_ix += reader.count_read_frames()
+
+        return -1
+
     def _next_reader(self):
         self.current_reader_index += 1
         self._set_metadata()
@@ -42,16 +93,20 @@ class SerialPcapReader:
         return self.readers[self.current_reader_index].get_sbet_data()
 
     def get_coordinates(self, rotate=True, show_progress=False):
-        """Returns a list of coordinates (SbetRow) corresponding to each LidarPacket in the current Pcap file."""
+        """Returns a Trajectory with the coordinates corresponding to each frame in all the Pcap files."""
 
-        coordinates = []
+        trajectories = []
         self.readers_first_coordinate_index = []
+        first_ix = 0
         
         for reader in tqdm(self.readers, ascii=True, desc="Extracting coordinates", disable=not show_progress):
-            self.readers_first_coordinate_index.append(len(coordinates))
-            coordinates.extend(reader.get_coordinates(False))
+            self.readers_first_coordinate_index.append(first_ix)
+            trajectories.append(reader.get_coordinates(False))
+            first_ix += len(trajectories[-1])
+
+        coordinates = Trajectory.concatenate(trajectories)
         
-        return SbetParser.rotate_points(coordinates, coordinates[0].heading - np.pi / 2) if rotate else coordinates
+        return coordinates.rotate_points(coordinates[0].heading - np.pi / 2) if rotate else coordinates
 
     def get_current_frame_index(self):
 
@@ -67,25 +122,33 @@ class SerialPcapReader:
     def remove_vehicle(self, frame, cloud=None):
         return self.readers[0].remove_vehicle(frame, cloud)
 
-    def next_frame(self, remove_vehicle:bool=False, timer=None, colored=True, max_distance=None):
+    def add_frame_filter(self, predicate):
+        for reader in self.readers:
+            reader.add_frame_filter(predicate)
+
+    def set_decimation(self, beam_step=1, column_step=1, point_budget=None):
+        for reader in self.readers:
+            reader.set_decimation(beam_step, column_step, point_budget)
+
+    def next_frame(self, remove_vehicle:bool=False, timer=None, colored=True, max_distance=None, as_frame=False):
         if self.current_reader_index >= len(self.readers):
             return None
 
-        frame = self.readers[self.current_reader_index].next_frame(remove_vehicle, timer, colored, max_distance)
+        frame = self.readers[self.current_reader_index].next_frame(remove_vehicle, timer, colored, max_distance, as_frame)
         if frame is None:
             self._next_reader()
-            return self.next_frame(remove_vehicle, timer, colored, max_distance)
+            return self.next_frame(remove_vehicle, timer, colored, max_distance, as_frame)
 
         return frame
 
     def get_pcap_path(self):
         return self.readers[self.current_reader_index].get_pcap_path()
 
-    def read_all_frames(self, remove_vehicle:bool=False):
+    def read_all_frames(self, remove_vehicle:bool=False, as_frame=False):
 
         frames = []
         while True:
-            frame = self.next_frame(remove_vehicle)
+            frame = self.next_frame(remove_vehicle, as_frame=as_frame)
             if frame is None:
                 return frames
             frames.append(frame)
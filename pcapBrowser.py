@@ -1,5 +1,6 @@
 from pcap.bufferedPcapReader import BufferedPcapReader
 from pcap.pcapReaderHelper import PcapReaderHelper
+from pcap.framePrefetcher import FramePrefetcher
 from utils.open3dVisualizer import Open3DVisualizer
 import argparse
 import open3d as o3d
@@ -17,23 +18,11 @@ class PcapBrowser:
         self.vis = Open3DVisualizer()
         self.save_screenshots_to = args.save_screenshots_to
 
-        browser = self
-        class RemoveVehicleProcessor:
+        # Toggled with P. The frames are filtered from the cached raw frames, so toggling does not decode them again.
+        self.remove_vehicle = False
 
-            def process(self, cloud):
-                xyz = np.asarray(cloud.points)
-                colors = np.asarray(cloud.colors)
-                
-                colors = browser.reader.remove_vehicle(xyz, colors)
-                xyz = browser.reader.remove_vehicle(xyz)
-
-                cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(xyz))
-                cloud.colors = o3d.utility.Vector3dVector(colors)
-
-                return cloud
-
-        self.cloud_processors = [None, RemoveVehicleProcessor()]
-        self.cloud_processor_index = 0
+        # Frames are decoded and filtered on a background thread, so the key callbacks only swap the shown geometry.
+        self.prefetcher = FramePrefetcher(self.read_frame, getattr(args, "prefetch_window", 16))
     
     def start_visualization(self):
         """Initializes an open3d visualizer, configures it to use arrow
@@ -53,8 +42,10 @@ class PcapBrowser:
             if not self.set_frame(self._currentFrame):
                 self._currentFrame += 1
 
-        def key_toggle_thinning(vis):
-            self.cloud_processor_index = (self.cloud_processor_index + 1) % len(self.cloud_processors)
+        def key_toggle_vehicle(vis):
+            self.remove_vehicle = not self.remove_vehicle
+            print("Remove vehicle:", self.remove_vehicle)
+            self.prefetcher.invalidate()
             self.set_frame(self._currentFrame)
 
         def key_print_info(vis):
@@ -66,7 +57,7 @@ class PcapBrowser:
             self.reader.max_distance += 1
             print("Max distance:", self.reader.max_distance)
             
-            self.reader.invalidate_cache()
+            self.prefetcher.invalidate()
             self.set_frame(self._currentFrame)
 
         def key_decrease_max_distance(vis):
@@ -79,13 +70,13 @@ class PcapBrowser:
 
             print("Max distance:", self.reader.max_distance)
             
-            self.reader.invalidate_cache()
+            self.prefetcher.invalidate()
             self.set_frame(self._currentFrame)
 
         self.vis.register_key_callback(262, key_next) # Arrow right
         self.vis.register_key_callback(263, key_prev) # Arrow left
         self.vis.register_key_callback(73, key_print_info) # I
-        self.vis.register_key_callback(80, key_toggle_thinning) # P
+        self.vis.register_key_callback(80, key_toggle_vehicle) # P
         self.vis.register_key_callback(75, key_decrease_max_distance) # K
         self.vis.register_key_callback(76, key_increase_max_distance) # L
         # List of key codes can be found here: https://www.glfw.org/docs/latest/group__keys.html
@@ -95,13 +86,16 @@ class PcapBrowser:
         self.vis.reset_view()
         self.vis.run()
 
+        self.prefetcher.stop()
+        self.prefetcher.print_statistics()
+
     def set_frame(self, num:int):
         """Show the frame with the given index in the visualizer. This function
         removes the geometry object containing the previous frame, then adds
         the geometry object containing the current frame. If the current frame is
         empty (end of file), this function does nothing, and returns False."""
 
-        frame = self.read_frame(num)
+        frame = self.prefetcher.get(num)
 
         if frame is None:
             return False
@@ -120,21 +114,17 @@ class PcapBrowser:
         return True
 
     def read_frame(self, num:int):
-        """Retrieves the current frame from the reader object, processes it (if activated), and converts it to an open3d geometry."""
-
-        frame = self.reader.read_frame(num)
-
-        # If a cloud processor is active, process the cloud (for example by voxel thinning)
-        if self.cloud_processors[self.cloud_processor_index] is not None:
-            frame = self.cloud_processors[self.cloud_processor_index].process(frame)
+        """Retrieves the current frame from the reader object, filtered with the current settings, as an open3d geometry."""
 
-        return frame
+        return self.reader.read_frame(num, self.remove_vehicle)
         
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     PcapReaderHelper.add_path_arguments(parser, browsing_only=True)
+    parser.add_argument('--frame-cache-mb', type=float, default=1024, required=False, help="The maximum amount of memory (in megabytes) used for keeping decoded frames. When the limit is reached, the least recently shown frames are thrown out (and decoded again if needed).")
+    parser.add_argument('--prefetch-window', type=int, default=16, required=False, help="The number of frames that are decoded in the background around the shown frame (mostly in the direction of travel), so that browsing does not have to wait for frames to be decoded.")
     parser.add_argument('--save-screenshots-to', type=str, default=None, required=False, help="If given, point cloud screenshots will be saved in this directory with their indices as filenames (0.png, 1.png, 2.png, etc). Only works if --preview is set to 'always'.")
     args = parser.parse_args()
 
@@ -31,7 +31,7 @@ class PcapToLas:
                 las = laspy.create()
 
                 # Getting the sbet-row with information of the position and heading at the given timestamp
-                sbet_row = self.reader.sbet.get_position(scan.timestamp[0], gps_week=self.reader.gps_week)
+                sbet_row = self.reader.sbet.get_position(scan.timestamp[0], gps_week=self.reader.gps_week, gps_epoch=self.reader.gps_epoch)
 
                 # Computing the heading
                 heading = -sbet_row.heading + np.pi/2
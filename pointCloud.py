@@ -4,48 +4,28 @@ import laspy
 import numpy as np
 import open3d as o3d
 import argparse
+from collections import OrderedDict
 
 from tqdm import tqdm
 from utils.open3dVisualizer import Open3DVisualizer
-
-class PointCloudPart:
-
-    def __init__(self, location):
-        self.location = location
-        self.file = laspy.open(location)
-
-    def is_relevant(self, x, y):
-        return self.file.header.x_min < x and self.file.header.x_max > x and self.file.header.y_min < y and self.file.header.y_max > y
-
-    def load(self):
-        self.contents = laspy.read(self.location)
-        return self.contents
-
-    def unload(self):
-        self.contents = None
+from utils.atomicFile import atomic_write
 
 class PointCloud:
 
     def __init__(self, point_cloud_location):
         self.location = point_cloud_location
         self.visualizer = Open3DVisualizer()
-        self.files = [PointCloudPart(os.path.join(self.location, x)) for x in os.listdir(self.location) if x.lower().endswith(".laz")]
         self.common_offsets = []
 
-    def get_relevant(self, x, y):
-
-        for f in self.files:
-            if True:#f.is_relevant(x, y):
-                yield f.load()
-            else:
-                pass #f.unload()
-
     def to_absolute(self, vector, lowest):
         return int(lowest) + vector / 1000.0
 
-    def read_all(self, preview = 'never', max_files=-1, voxel_size=None):
+    def read_all(self, preview = 'never', max_files=-1, voxel_size=None, dtype=np.float64):
+        """Reads all .laz files into one point cloud, relative to the common offset. With dtype=np.float32,
+        the points are kept in a float32 array (and downsampled) before the Open3D cloud is created."""
 
         full_cloud = o3d.geometry.PointCloud()
+        float32_parts = []
 
         # List all .laz files in the given directory
         files = [os.path.join(self.location, x) for x in os.listdir(self.location) if x.lower().endswith(".laz")]
@@ -78,6 +58,10 @@ class PointCloud:
             # Merge X, Y and Z values together to a 3D array
             point_data = np.stack([x, y, z], axis=0).transpose((1, 0))
 
+            if dtype == np.float32:
+                float32_parts.append(point_data.astype(np.float32))
+                continue
+
             # Create an open3d point cloud
             partial_cloud = o3d.geometry.PointCloud()
             partial_cloud.points = o3d.utility.Vector3dVector(point_data)
@@ -88,7 +72,21 @@ class PointCloud:
                 self.visualizer.show_frame(full_cloud)
                 self.visualizer.refresh_non_blocking()
 
-        if voxel_size is not None:
+        if dtype == np.float32:
+            points = np.concatenate(float32_parts)
+            float32_parts = None
+            self.original_point_count = len(points)
+
+            if voxel_size is not None:
+                with tqdm(total=1, desc="Downsampling") as pbar:
+                    tensor_cloud = o3d.t.geometry.PointCloud(o3d.core.Tensor.from_numpy(points))
+                    points = tensor_cloud.voxel_down_sample(voxel_size=voxel_size).point["positions"].numpy()
+                    self.downsampled_point_count = len(points)
+                    pbar.update(1)
+
+            full_cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points.astype(np.float64)))
+
+        elif voxel_size is not None:
             with tqdm(total=1, desc="Downsampling") as pbar:
                 self.original_point_count = len(full_cloud.points)
                 full_cloud = full_cloud.voxel_down_sample(voxel_size=voxel_size)
@@ -117,6 +115,153 @@ class PointCloud:
         return full_cloud
 
 
+class TileIndex:
+    """The bounds of every .laz tile in a directory, read from the LAZ headers only (no points are decoded).
+    The index is cached as tile-index.json in the directory, and only the headers of new or changed tiles
+    are read when it is loaded again."""
+
+    def __init__(self, location, show_progress=True):
+        self.location = location
+        self.index_path = os.path.join(location, "tile-index.json")
+
+        cached = {}
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    cached = { tile["file"]: tile for tile in json.load(f)["tiles"] }
+            except:
+                cached = {}
+
+        tiles = []
+        has_changed = False
+        files = sorted([x for x in os.listdir(location) if x.lower().endswith(".laz")])
+
+        for file in tqdm(files, "Indexing point cloud tiles", disable=not show_progress):
+            stat = os.stat(os.path.join(location, file))
+            tile = cached.get(file)
+
+            if tile is None or tile["size"] != stat.st_size or tile["mtime"] != stat.st_mtime:
+                with laspy.open(os.path.join(location, file)) as las:
+                    header = las.header
+                    tile = {
+                        "file": file,
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime,
+                        "mins": [header.x_min, header.y_min, header.z_min],
+                        "maxes": [header.x_max, header.y_max, header.z_max],
+                        "point_count": header.point_count
+                    }
+                has_changed = True
+
+            tiles.append(tile)
+
+        if len(tiles) < 1:
+            raise Exception(f"Found no .laz files in {location}.")
+
+        if has_changed or len(tiles) != len(cached):
+            try:
+                with atomic_write(self.index_path) as f:
+                    json.dump({ "tiles": tiles }, f)
+            except OSError:
+                tqdm.write(f"Could not save the tile index to {self.index_path}, it will be created again next time.")
+
+        self.tiles = tiles
+        self.paths = [os.path.join(location, tile["file"]) for tile in tiles]
+        self.mins = np.array([tile["mins"] for tile in tiles], dtype=np.float64)
+        self.maxes = np.array([tile["maxes"] for tile in tiles], dtype=np.float64)
+
+        # The center of all tiles, used as the offset of the local coordinates (like the offset of a point cloud created by read_all).
+        self.offset = np.amin(self.mins, axis=0) + (np.amax(self.maxes, axis=0) - np.amin(self.mins, axis=0)) / 2
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def query(self, min_bound, max_bound):
+        """Returns the indices of the tiles intersecting the given box (in absolute coordinates)."""
+        return np.flatnonzero(np.all(self.mins <= max_bound, axis=1) & np.all(self.maxes >= min_bound, axis=1))
+
+class TileManager:
+    """Loads the points of the tiles in a TileIndex on demand, relative to the offset of the index. Loaded
+    tiles are kept in memory as long as their total size stays below max_bytes; after that, the least 
+    recently used tiles are thrown out (and read again if they are needed later). This way, navigation 
+    can run against a reference dataset that is far larger than the available memory."""
+
+    def __init__(self, index, max_bytes=2 * 1024 * 1024 * 1024, voxel_size=None, dtype=np.float64):
+        self.index = index
+        self.offset = index.offset
+        self.max_bytes = max_bytes
+        self.voxel_size = voxel_size
+        self.dtype = dtype
+
+        self.tiles = OrderedDict()
+        self.loaded_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def load_tile(self, ix):
+        """Reads the points of the given tile, relative to the offset (and downsampled if a voxel size is given).
+        The .laz files have no normals, so they are estimated here (like pointCloud.py does before writing a .pcd),
+        and returned as columns 3-5 of an (N, 6) array."""
+
+        las = laspy.read(self.index.paths[ix])
+        points = np.column_stack((las.x - self.offset[0], las.y - self.offset[1], las.z - self.offset[2])).astype(self.dtype)
+
+        if self.voxel_size is not None:
+            tensor_cloud = o3d.t.geometry.PointCloud(o3d.core.Tensor.from_numpy(points))
+            points = tensor_cloud.voxel_down_sample(voxel_size=self.voxel_size).point["positions"].numpy()
+
+        cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points.astype(np.float64)))
+        cloud.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.1, max_nn=30))
+
+        return np.hstack((points, np.asarray(cloud.normals))).astype(self.dtype, copy=False)
+
+    def get_tile(self, ix):
+        if ix in self.tiles:
+            self.hits += 1
+            self.tiles.move_to_end(ix)
+            return self.tiles[ix]
+
+        self.misses += 1
+        points = self.load_tile(ix)
+        self.tiles[ix] = points
+        self.loaded_bytes += points.nbytes
+
+        # Always keep the newest tile, even if it is larger than the budget on its own.
+        while self.loaded_bytes > self.max_bytes and len(self.tiles) > 1:
+            (_, evicted) = self.tiles.popitem(last=False)
+            self.loaded_bytes -= evicted.nbytes
+
+        return points
+
+    def crop(self, min_bound, max_bound):
+        """Returns an (N, 6) array with the points (and their normals) inside the given box (in local coordinates,
+        relative to the offset), loading the tiles intersecting the box if they are not loaded already."""
+
+        min_bound = np.asarray(min_bound, dtype=np.float64)
+        max_bound = np.asarray(max_bound, dtype=np.float64)
+
+        parts = []
+        for ix in self.index.query(min_bound + self.offset, max_bound + self.offset):
+            points = self.get_tile(ix)
+            inside = np.all(points[:, :3] >= min_bound.astype(points.dtype), axis=1)
+            inside &= np.all(points[:, :3] <= max_bound.astype(points.dtype), axis=1)
+            parts.append(points[inside])
+
+        if len(parts) < 1:
+            return np.zeros((0, 6), dtype=self.dtype)
+
+        return np.concatenate(parts)
+
+    def get_loaded_points(self):
+        """Returns the points of all currently loaded tiles."""
+
+        if len(self.tiles) < 1:
+            return np.zeros((0, 3), dtype=self.dtype)
+
+        return np.concatenate([points[:, :3] for points in self.tiles.values()])
+
+
 def load_point_cloud(path):
 
     full_cloud = o3d.io.read_point_cloud(path)
@@ -134,7 +279,7 @@ def process_args(args):
         return
 
     reader = PointCloud(args.create_from)
-    cloud = reader.read_all(args.preview, args.max_files, args.voxel_size)
+    cloud = reader.read_all(args.preview, args.max_files, args.voxel_size, np.float32 if args.float32 else np.float64)
 
     if args.write_to is not None:
         with tqdm(total=1, desc="Estimating normals") as pbar:
@@ -168,6 +313,7 @@ if __name__ == "__main__":
     parser.add_argument('--max-files', type=int, default=-1, help="Stop reading after the given number of files (useful for saving time while testing).")
     parser.add_argument('--write-to', type=str, default=None, help="Write the assembled point cloud to this location.")
     parser.add_argument("--show", type=str, help="A .pcd file to show -- will not do any processing, just show it.")
+    parser.add_argument('--float32', action='store_true', help="If set, the point cloud is read and downsampled as 32-bit floats (relative to the common offset), which halves the memory usage.")
 
     args = parser.parse_args()
 
@@ -1,17 +1,48 @@
 import argparse
 from itertools import chain
-from tqdm import tqdm  
+from tqdm import tqdm
 import os
+import time
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from pcap.pcapReader import PcapReader
 from pcap.pcapReaderHelper import PcapReaderHelper
+from sbet.sbetParser import SbetParser
+
+# The arguments used by every PcapReader in this process, see initialize_worker.
+worker_args = None
+
+def initialize_worker(args):
+    """Runs once in every worker process. The SBET file is parsed here (once per process, not once per pcap file),
+    and shared by all readers in the process through SbetParser.load. The SBET records are memory-mapped,
+    so all processes share the same pages of the file through the OS instead of each reading it into memory."""
+
+    global worker_args
+    worker_args = args
+
+    SbetParser.load(args.sbet, args.sbet_noise, args.sbet_noise_from_frame_ix, args.sbet_crs_from, args.sbet_crs_to)
+
+def recreate_cache(pcap):
+    """Recreates the caches of a single pcap file (unless they are up to date). Returns the pcap path,
+    whether the file was skipped, the number of frames, and the error message if it failed."""
+
+    try:
+        reader = PcapReader(pcap, args=worker_args)
+        if reader.has_valid_caches():
+            return (pcap, True, reader.count_frames(), None)
+
+        reader.scan_metadata()
+        return (pcap, False, reader.count_frames(), None)
+    except Exception as e:
+        return (pcap, False, 0, str(e))
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--root-directory', type=str, required=True, help="Recreate caches for all pcap files found recursively under the given root directory.")
-    parser.add_argument('--recreate-caches', action='store_true', required=False, help="If True, existing caches will be re-created. If False, files with existing caches will be skipped.")
+    parser.add_argument('--recreate-caches', action='store_true', required=False, help="If True, existing caches will be re-created. If False, files with up to date caches will be skipped.")
+    parser.add_argument('--workers', type=int, default=1, required=False, help="The number of processes used for recreating caches in parallel. Each process handles one pcap file at a time.")
     PcapReaderHelper.add_sbet_arguments(parser)
     args = parser.parse_args()
 
@@ -21,17 +52,40 @@ if __name__ == "__main__":
 
     files = list([x for x in chain.from_iterable(glob(os.path.join(x[0], '*.pcap')) for x in os.walk(args.root_directory)) if not x.endswith(".pcap.meta.json")])
 
+    # Parse the SBET file before starting any workers, so that a CSV SBET file is converted (and cached) only once,
+    # and so that workers started by forking inherit the parsed file.
+    initialize_worker(args)
+
     failures = []
     successes = 0
-    for pcap in tqdm(files, ascii=True, desc="Recreating caches"):
-        try:
-            reader = PcapReader(pcap, args=args)
-            reader.count_frames()
-            reader.get_coordinates()
-            successes += 1
-        except Exception as e:
+    skipped = 0
+    frames = 0
+    start_time = time.perf_counter()
+
+    def register(result):
+        global successes, skipped, frames
+        (pcap, was_skipped, frame_count, error) = result
+        if error is not None:
             failures.append(pcap)
-            tqdm.write(f"ERROR: {e}")
+            tqdm.write(f"ERROR: {pcap}: {error}")
+        elif was_skipped:
+            skipped += 1
+        else:
+            successes += 1
+            frames += frame_count
+
+    if args.workers <= 1:
+        for pcap in tqdm(files, ascii=True, desc="Recreating caches"):
+            register(recreate_cache(pcap))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=initialize_worker, initargs=(args,)) as executor:
+            futures = [executor.submit(recreate_cache, pcap) for pcap in files]
+            for future in tqdm(as_completed(futures), total=len(futures), ascii=True, desc=f"Recreating caches ({args.workers} workers)"):
+                register(future.result())
+
+    elapsed = time.perf_counter() - start_time
 
     tqdm.write(f"Succesful: {successes}")
-    tqdm.write(f"Failed: {failures}")
\ No newline at end of file
+    tqdm.write(f"Skipped (caches up to date): {skipped}")
+    tqdm.write(f"Failed: {failures}")
+    tqdm.write(f"Time: {elapsed:.1f} s, {successes / elapsed if elapsed > 0 else 0:.2f} files/s, {frames / elapsed if elapsed > 0 else 0:.1f} frames/s")
@@ -0,0 +1,56 @@
+import numpy as np
+
+# Vectorized conversions between roll/pitch/heading (radians, rotating about x, y and z, applied in
+# the order z-y-x) and unit quaternions (N, 4) as (w, x, y, z), used for interpolating orientations.
+
+def euler_to_quaternions(roll, pitch, heading):
+    cr = np.cos(np.asarray(roll) / 2)
+    sr = np.sin(np.asarray(roll) / 2)
+    cp = np.cos(np.asarray(pitch) / 2)
+    sp = np.sin(np.asarray(pitch) / 2)
+    cy = np.cos(np.asarray(heading) / 2)
+    sy = np.sin(np.asarray(heading) / 2)
+
+    return np.column_stack((
+        cr * cp * cy + sr * sp * sy,
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy
+    ))
+
+def quaternions_to_euler(q):
+    """Returns (roll, pitch, heading) arrays for the given (N, 4) quaternions. Roll and heading are in (-pi, pi]."""
+
+    (w, x, y, z) = (q[:, 0], q[:, 1], q[:, 2], q[:, 3])
+
+    roll = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+    pitch = np.arcsin(np.clip(2 * (w * y - z * x), -1, 1))
+    heading = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+
+    return (roll, pitch, heading)
+
+def slerp(q0, q1, t):
+    """Spherical linear interpolation between the rows of q0 and q1 (N, 4), where t (N,) goes from 0 (q0) to 1 (q1).
+    Always interpolates along the shortest arc. Nearly identical rotations are interpolated linearly."""
+
+    t = np.asarray(t)[:, np.newaxis]
+    dot = np.einsum("ij,ij->i", q0, q1)[:, np.newaxis]
+
+    # q and -q are the same rotation, so flip q1 where needed to take the shortest arc.
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1, 1))
+    sin_theta = np.sin(theta)
+    linear = sin_theta < 1e-6
+    safe_sin_theta = np.where(linear, 1, sin_theta)
+
+    s0 = np.where(linear, 1 - t, np.sin((1 - t) * theta) / safe_sin_theta)
+    s1 = np.where(linear, t, np.sin(t * theta) / safe_sin_theta)
+
+    q = s0 * q0 + s1 * q1
+    return q / np.linalg.norm(q, axis=1)[:, np.newaxis]
+
+def wrap_angles(angles):
+    """Wraps angles (radians) to [-pi, pi)."""
+    return (np.asarray(angles) + np.pi) % (2 * np.pi) - np.pi
@@ -7,6 +7,7 @@ Created on Mon Aug 29 13:34:01 2022
 
 import numpy as np
 import datetime
+import os
 
 # LEAP SECONDS
 DELTA_UNIX_GPS = 18
@@ -35,42 +36,46 @@ def timestamp_sow2unix(sow, gps_week):
     unix = sow + 315964800 + (gps_week * 604800)
     return unix
 
-# leser sbet og smrmsg. Under record types ser du feltene i hver fil
-def read_sbet(sbet_filename, smrmsg_filename) -> np.array:
-    sbet_record_types = [
-        ("time", np.float64),
-        ("lat", np.float64),  # radians
-        ("lon", np.float64),  # radians
-        ("alt", np.float64),
-        ("x-vel", np.float64),  # m/s
-        ("y-vel", np.float64),
-        ("vert-vel", np.float64),
-        ("roll", np.float64),  # radians
-        ("pitch", np.float64),
-        ("heading", np.float64),
-        ("wander", np.float64),  # radians
-        ("x-acc", np.float64),  # m/s^2
-        ("y-acc", np.float64),
-        ("vert-acc", np.float64),
-        ("x-angrate", np.float64),  # radians/s
-        ("y-angrate", np.float64),
-        ("z-angrate", np.float64)
-    ]
+sbet_record_types = [
+    ("time", np.float64),
+    ("lat", np.float64),  # radians
+    ("lon", np.float64),  # radians
+    ("alt", np.float64),
+    ("x-vel", np.float64),  # m/s
+    ("y-vel", np.float64),
+    ("vert-vel", np.float64),
+    ("roll", np.float64),  # radians
+    ("pitch", np.float64),
+    ("heading", np.float64),
+    ("wander", np.float64),  # radians
+    ("x-acc", np.float64),  # m/s^2
+    ("y-acc", np.float64),
+    ("vert-acc", np.float64),
+    ("x-angrate", np.float64),  # radians/s
+    ("y-angrate", np.float64),
+    ("z-angrate", np.float64)
+]
 
-    # kolonner funnet ved å sammenligne txt eksport fra Qinertia
-    smrmsg_record_types = [
-        ("time", np.float64),
-        ("lat-std", np.float64),  # radians
-        ("lon-std", np.float64),  # radians
-        ("alt-std", np.float64),
-        ("roll-std", np.float64),
-        ("pitch-std", np.float64),
-        ("yaw-std", np.float64),
-        ("unknown1", np.float64),  # akselerasjon std.dev?
-        ("unknown2", np.float64),
-        ("unknown3", np.float64)
-    ]
-    sbet_np = np.fromfile(sbet_filename, dtype=np.dtype(sbet_record_types))
-    smrmsg_np = np.fromfile(smrmsg_filename, dtype=np.dtype(smrmsg_record_types))
+# kolonner funnet ved å sammenligne txt eksport fra Qinertia
+smrmsg_record_types = [
+    ("time", np.float64),
+    ("lat-std", np.float64),  # radians
+    ("lon-std", np.float64),  # radians
+    ("alt-std", np.float64),
+    ("roll-std", np.float64),
+    ("pitch-std", np.float64),
+    ("yaw-std", np.float64),
+    ("unknown1", np.float64),  # akselerasjon std.dev?
+    ("unknown2", np.float64),
+    ("unknown3", np.float64)
+]
 
-    return sbet_np, smrmsg_np
\ No newline at end of file
+# Memory-maps the records in an SBET file (without the smrmsg file). Nothing is read from disk
+# until the records are accessed. Any trailing partial record is ignored, and an empty file gives
+# an empty array (np.memmap can't map zero bytes).
+def read_sbet_records(sbet_filename) -> np.memmap:
+    dtype = np.dtype(sbet_record_types)
+    count = os.path.getsize(sbet_filename) // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(sbet_filename, dtype=dtype, mode="r", shape=(count,))
\ No newline at end of file
@@ -1,54 +1,165 @@
-from sbet.sbetHelpers import read_sbet, filename2gpsweek, filename2utc, timestamp_unix2sow, timestamp_sow2unix
+from sbet.sbetHelpers import sbet_record_types, read_sbet_records, filename2gpsweek, filename2utc, timestamp_unix2sow, timestamp_sow2unix
 import os
 import numpy as np
-import open3d as o3d
 import csv
-import random
 from pyproj import Transformer
 
 from sbet.sbetRow import SbetRow
+from sbet.trajectory import Trajectory, TRAJECTORY_DTYPE, rotate_xy
+from utils.atomicFile import atomic_write
+from sbet.rotations import euler_to_quaternions, quaternions_to_euler, slerp, wrap_angles
 
 class SbetParser:
 
+    # Parsers that have already been loaded in this process, see SbetParser.load.
+    loaded_parsers = {}
+
+    # Seconds of SBET data to read on each side of the requested time window, see ensure_window.
+    WINDOW_MARGIN = 10
+
     def __init__(self, filename, random_noise, noise_from_frame_ix=0, crs_from=4979, crs_to=5972):
 
+        # The records of the SBET file are memory-mapped, and only the rows within the time
+        # window that is actually used are converted and kept in self.rows (see ensure_window).
+        # self.row_offset is the index of the first row in self.rows within the full file.
+        # CSV files are converted to the same record type (see read_csv), and handled the same way.
+        self.filename = filename
+
         if filename.lower().endswith(".csv"):
-            self.rows = SbetParser.read_csv(filename)
+            self.records = SbetParser.read_csv(filename)
         else:
-            self.rows = SbetParser.read_latlon(filename, filename.replace(".out", "-smrmsg.out"))
+            self.records = read_sbet_records(filename)
+        self.total_row_count = len(self.records)
+        rows = SbetParser.convert_records(self.records[0:0])
 
         self.random_noise = random_noise
         self.add_noise = random_noise is not None and (random_noise[0] > 0 or random_noise[1] > 0 or random_noise[2] > 0)
         self.noise_from_frame_ix = noise_from_frame_ix
 
         self.current_index = 0
-        self.row_count = len(self.rows)
 
-        # Used for transforming read coordinates to the correct reference frame upon request.
-        # Must be initialized with self.create_transformer, which is automatically called in 
-        # get_position, but not get_rows.
+        # The GPS epoch used when transforming coordinates, unless another epoch is given. A parser may be
+        # shared by readers of different pcap files (see SbetParser.load), so get_position and get_positions
+        # never change it, but use the epoch given to them (or the epoch of the given pcap file) instead.
         self.gps_epoch = None
         self.transformer = None
-        self.current_filename = None
 
         self.crs_from = crs_from
         self.crs_to = crs_to
         self.transformer = Transformer.from_crs(self.crs_from, self.crs_to, always_xy=True)
 
+        self._set_rows(rows, 0)
+
+    def _set_rows(self, rows, row_offset):
+        self.rows = rows
+        self.row_offset = row_offset
+        self.row_count = len(rows)
+
+        # Sorted array of the SBET times in self.rows, used for binary searching positions.
+        self.times = np.ascontiguousarray(rows["time"])
+
+        # Transformed (x, y, alt) arrays for self.rows, keyed by (crs_from, crs_to, gps_epoch).
+        self.projected = {}
+
+    @staticmethod
+    def load(filename, random_noise=None, noise_from_frame_ix=0, crs_from=4979, crs_to=5972):
+        """Returns a parser for the given SBET file and settings, parsing the file only the first time it
+        is requested in this process. All readers in a run (for example one PcapReader per pcap file in a
+        SerialPcapReader) therefore share the parsed file, the transformer and the projected trajectory.
+        Since the SBET records are memory-mapped, worker processes reading the same file share its pages
+        through the OS, and processes started by forking inherit the already loaded parsers."""
+
+        key = (os.path.abspath(filename), None if random_noise is None else tuple(random_noise), noise_from_frame_ix, crs_from, crs_to)
+
+        if key not in SbetParser.loaded_parsers:
+            SbetParser.loaded_parsers[key] = SbetParser(filename, random_noise, noise_from_frame_ix, crs_from, crs_to)
+
+        return SbetParser.loaded_parsers[key]
+
+    def _find_record(self, sow):
+        """Binary searches the memory-mapped records for the index of the first record with a time
+        larger than or equal to sow. Only the pages containing the visited records are read."""
+
+        lo = 0
+        hi = self.total_row_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.records[mid]["time"] < sow:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def ensure_window(self, min_sow, max_sow, margin=WINDOW_MARGIN):
+        """Makes sure that self.rows contains all rows needed to look up positions between min_sow
+        and max_sow (seconds of week), with margin seconds to spare on each side. The window is only
+        ever extended, so row indices stay valid."""
+
+        start = max(0, self._find_record(min_sow - margin) - 1)
+        end = min(self.total_row_count, self._find_record(max_sow + margin) + 1)
+
+        if self.row_count > 0:
+            window_end = self.row_offset + self.row_count
+            if start >= self.row_offset and end <= window_end:
+                return
+
+            # Only convert (and project) the rows that are added before and after the current window.
+            before = SbetParser.convert_records(self.records[min(start, self.row_offset):self.row_offset])
+            after = SbetParser.convert_records(self.records[window_end:max(end, window_end)])
+            self._extend_rows(before, after)
+            return
+
+        self._set_rows(SbetParser.convert_records(self.records[start:end]), start)
+
+    def _extend_rows(self, before, after):
+        """Adds the given converted rows before and after self.rows. The cached projections are kept,
+        and extended with the projections of the new rows only."""
+
+        projected = {}
+        for (key, cached) in self.projected.items():
+            (_, _, gps_epoch) = key
+            added_before = self.transform(before["lon"], before["lat"], before["alt"], gps_epoch)
+            added_after = self.transform(after["lon"], after["lat"], after["alt"], gps_epoch)
+            projected[key] = tuple(np.concatenate((added_before[i], cached[i], added_after[i])) for i in range(3))
+
+        self._set_rows(np.concatenate((before, self.rows, after)), self.row_offset - len(before))
+        self.projected = projected
+
+    def ensure_window_unix(self, min_time_unix, max_time_unix, gps_week, margin=WINDOW_MARGIN):
+        """Same as ensure_window, but for unix timestamps in nanoseconds (as in the pcap internal meta)."""
+
+        self.ensure_window(timestamp_unix2sow(min_time_unix / 1000000000, gps_week), timestamp_unix2sow(max_time_unix / 1000000000, gps_week), margin)
+
+    def load_all(self):
+        """Reads all rows in the file (used when the whole trajectory is needed)."""
+
+        self.ensure_window(-np.inf, np.inf, 0)
+
+    def get_time_range(self):
+        """Returns the first and last time (seconds of week) in the full file."""
+
+        if self.total_row_count == 0:
+            return (None, None)
+        return (float(self.records[0]["time"]), float(self.records[-1]["time"]))
+
     def reset(self):
         self.current_index = 0
 
-    def create_transformer(self, pcap_filename):
-        self.gps_epoch = self.get_gps_epoch(pcap_filename)
-        self.current_filename = pcap_filename
+    def get_epoch_for(self, pcap_filename, gps_epoch=None):
+        """Returns the given GPS epoch, or else the epoch of the given pcap file, or else the default epoch."""
+
+        if gps_epoch is not None:
+            return gps_epoch
+        if pcap_filename is not None:
+            return self.get_gps_epoch(pcap_filename)
+        return self.gps_epoch
 
-    def get_position(self, timestamp=None, pcap_filename=None, pcap_path=None, gps_week=None, continue_from_previous=False, frame_ix=-1):
+    def get_position(self, timestamp=None, pcap_filename=None, pcap_path=None, gps_week=None, continue_from_previous=False, frame_ix=-1, gps_epoch=None):
 
         if pcap_path is not None:
             pcap_filename = os.path.basename(pcap_path)
 
-        if pcap_filename != self.current_filename:
-            self.create_transformer(pcap_filename)
+        gps_epoch = self.get_epoch_for(pcap_filename, gps_epoch)
 
         if gps_week is None:
             gps_week = self.get_gps_week(pcap_path, pcap_filename)
@@ -57,25 +168,179 @@ class SbetParser:
         sow = timestamp_unix2sow(timestamp / 1000000000, gps_week)
 
         start_ix = self.current_index if continue_from_previous else 1
-        for i in range(start_ix, self.row_count):
+        i = self.get_row_indices(np.array([sow]), start_ix, frame_ix)[0]
 
-            if self.rows[i]["time"] >= sow:
-                self.current_index = i
-                sbetRow = SbetRow(self.rows[i-1], sow, i)
-                sbetRow.calculate_transformed(self.transformer, self.gps_epoch)
+        self.current_index = i
+        return self._create_row(i, sow, frame_ix, gps_epoch)
 
-                if self.add_noise and frame_ix > self.noise_from_frame_ix:
-                    sbetRow.x += random.uniform(-self.random_noise[0], self.random_noise[0])
-                    sbetRow.y += random.uniform(-self.random_noise[1], self.random_noise[1])
-                    sbetRow.alt += random.uniform(-self.random_noise[2], self.random_noise[2])
+    def get_positions(self, timestamps, pcap_filename=None, pcap_path=None, gps_week=None, first_frame_ix=0, add_noise=True, interpolate=False, gps_epoch=None):
+        """Returns the positions (SbetRow) for an array of frame timestamps (unix time in nanoseconds) at once.
+        The timestamp at index i is treated as the frame with index first_frame_ix + i (used for noise).
+        With add_noise=False, the actual positions are returned even if random noise is configured
+        (the noise can be added later with apply_noise). With interpolate=True, the positions are
+        interpolated between the SBET rows around each timestamp (see sample_poses), instead of
+        using the last row before it. The coordinates are transformed with the given GPS epoch, or else
+        with the epoch of the pcap file."""
 
-                return sbetRow
+        if pcap_path is not None:
+            pcap_filename = os.path.basename(pcap_path)
 
-        self.current_index = 0
+        gps_epoch = self.get_epoch_for(pcap_filename, gps_epoch)
+
+        if gps_week is None:
+            gps_week = self.get_gps_week(pcap_path, pcap_filename)
+
+        sows = timestamp_unix2sow(np.asarray(timestamps) / 1000000000, gps_week)
+        if interpolate:
+            trajectory = self.sample_poses(sows, first_frame_ix, gps_epoch)
+        else:
+            trajectory = self._create_rows(self.get_row_indices(sows, 1, first_frame_ix), sows, gps_epoch)
+
+        if add_noise:
+            self.apply_noise(trajectory, first_frame_ix)
+
+        return trajectory
+
+    def get_row_indices(self, sows, start_ix=1, first_frame_ix=0):
+        """Binary searches the SBET times for an array of times (seconds of week), and returns the index of the
+        first row with a time larger than or equal to each time (never lower than start_ix). The position used 
+        for a time is the row before this index. The indices are relative to the full file, not the window."""
+
+        sows = np.asarray(sows)
+        if len(sows) > 0:
+            self.ensure_window(np.min(sows), np.max(sows))
+
+        indices = np.maximum(np.searchsorted(self.times, sows, side="left") + self.row_offset, start_ix)
+
+        missing = np.flatnonzero(indices >= self.total_row_count)
+        if len(missing) > 0:
+            self.current_index = 0
+            frame_ix = first_frame_ix + missing[0] if first_frame_ix >= 0 else first_frame_ix
+            (first_time, last_time) = self.get_time_range()
+            raise Exception(f"Failed to find a coordinate for the frame at index={frame_ix}, sow={sows[missing[0]]}. Sbet file has coordinates from sow={first_time} to sow={last_time}")
+
+        return indices
+
+    def _create_row(self, i, sow, frame_ix, gps_epoch=None):
+        trajectory = self._create_rows([i], [sow], gps_epoch)
+        self.apply_noise(trajectory, frame_ix)
+        return trajectory[0].clone()
+
+    def _create_rows(self, indices, sows, gps_epoch=None):
+        """Creates a Trajectory from the rows before the given indices, with all coordinates
+        transformed in one vectorized call."""
 
-        raise Exception(f"Failed to find a coordinate for the frame at index={frame_ix}, time={timestamp}, sow={sow}. Sbet file has coordinates from sow={self.rows[0]['time']} to sow={self.rows[-1]['time']}")
+        indices = np.asarray(indices, dtype=np.int64)
+        rows = indices - 1 - self.row_offset
 
-        return None
+        trajectory = np.zeros(len(indices), dtype=TRAJECTORY_DTYPE)
+        trajectory["sow"] = self.times[rows]
+        trajectory["age"] = np.asarray(sows) - trajectory["sow"]
+        trajectory["index"] = indices
+        for name in ["lat", "lon", "roll", "pitch", "heading"]:
+            trajectory[name] = self.get_column(name, rows)
+
+        (trajectory["x"], trajectory["y"], trajectory["alt"]) = self.get_projected(rows, gps_epoch)
+
+        return Trajectory(trajectory)
+
+    def sample_poses(self, sows, first_frame_ix=0, gps_epoch=None):
+        """Returns a Trajectory with the pose at each of the given times (seconds of week), which can be
+        anything from one time per frame to one time per column in a scan. The position (x/y/alt in the
+        target CRS, and lat/lon) is interpolated linearly between the SBET rows before and after each time,
+        and the orientation (roll/pitch/heading) with spherical linear interpolation. The sow of each pose 
+        is the requested time, so the age is 0, and the index is the index of the row after the time.
+        The coordinates are transformed with the given GPS epoch (or the default epoch)."""
+
+        sows = np.asarray(sows, dtype=np.float64)
+        indices = self.get_row_indices(sows, 1, first_frame_ix)
+        after = indices - self.row_offset
+        before = after - 1
+
+        t0 = self.times[before]
+        t1 = self.times[after]
+        span = t1 - t0
+        t = np.divide(sows - t0, span, out=np.zeros_like(sows), where=span > 0)
+
+        # Times before the first row get the pose of the first row, instead of being extrapolated backwards
+        # (get_row_indices never gives an index below 1, so t is negative for them).
+        t = np.clip(t, 0, 1)
+
+        trajectory = np.zeros(len(sows), dtype=TRAJECTORY_DTYPE)
+        trajectory["sow"] = sows
+        trajectory["index"] = indices
+
+        (x, y, alt) = self.get_projected(gps_epoch=gps_epoch)
+        for (name, values) in [("x", x), ("y", y), ("alt", alt), ("lat", self.rows["lat"]), ("lon", self.rows["lon"])]:
+            trajectory[name] = values[before] + (values[after] - values[before]) * t
+
+        q0 = euler_to_quaternions(self.rows["roll"][before], self.rows["pitch"][before], self.rows["heading"][before])
+        q1 = euler_to_quaternions(self.rows["roll"][after], self.rows["pitch"][after], self.rows["heading"][after])
+        (roll, pitch, heading) = quaternions_to_euler(slerp(q0, q1, t))
+
+        # Keep the angles in the same range as the SBET angles (by staying close to the angles of the row before).
+        for (name, values) in [("roll", roll), ("pitch", pitch), ("heading", heading)]:
+            previous = self.rows[name][before]
+            trajectory[name] = previous + wrap_angles(values - previous)
+
+        return Trajectory(trajectory)
+
+    def apply_noise(self, trajectory, first_frame_ix=0):
+        """Adds the configured random noise (if any) to the positions in the given Trajectory, where
+        row i is treated as the frame with index first_frame_ix + i."""
+
+        if not self.add_noise:
+            return trajectory
+
+        data = trajectory.data
+        noisy = np.arange(len(data)) + first_frame_ix > self.noise_from_frame_ix
+        count = np.count_nonzero(noisy)
+        data["x"][noisy] += np.random.uniform(-self.random_noise[0], self.random_noise[0], count)
+        data["y"][noisy] += np.random.uniform(-self.random_noise[1], self.random_noise[1], count)
+        data["alt"][noisy] += np.random.uniform(-self.random_noise[2], self.random_noise[2], count)
+
+        return trajectory
+
+    def get_column(self, name, indices=None):
+        """Returns the given column as a NumPy array, optionally only for the given row indices."""
+
+        return self.rows[name] if indices is None else self.rows[name][indices]
+
+    def transform(self, lon, lat, alt, gps_epoch=None):
+        """Transforms arrays of coordinates from crs_from to crs_to in a single vectorized call, using
+        the given GPS epoch, or the default epoch (if any). Returns a tuple of (x, y, alt) arrays."""
+
+        if gps_epoch is None:
+            gps_epoch = self.gps_epoch
+
+        if len(lon) == 0:
+            return (np.zeros(0), np.zeros(0), np.zeros(0))
+
+        if gps_epoch is None:
+            x, y = self.transformer.transform(lon, lat)
+            return (np.asarray(x), np.asarray(y), np.array(alt, dtype=np.float64))
+
+        x, y, alt, _ = self.transformer.transform(lon, lat, alt, np.full(len(lon), gps_epoch))
+        return (np.asarray(x), np.asarray(y), np.asarray(alt))
+
+    def get_projected(self, indices=None, gps_epoch=None):
+        """Returns the transformed (x, y, alt) arrays for the given row indices (within self.rows), or
+        for all rows, using the given GPS epoch (or the default epoch). All rows in the window are transformed
+        once per (crs_from, crs_to, gps_epoch), also when only some rows are requested, so that later lookups
+        (like the per-frame lookups during navigation) are picked from the cache instead of transformed again."""
+
+        if gps_epoch is None:
+            gps_epoch = self.gps_epoch
+
+        key = (self.crs_from, self.crs_to, gps_epoch)
+
+        if key not in self.projected:
+            self.projected[key] = self.transform(self.rows["lon"], self.rows["lat"], self.rows["alt"], gps_epoch)
+
+        (x, y, alt) = self.projected[key]
+        if indices is None:
+            return (x, y, alt)
+        return (x[indices], y[indices], alt[indices])
 
     def get_gps_epoch(self, pcap_filename):
 
@@ -97,54 +362,108 @@ class SbetParser:
 
     @staticmethod
     def read_csv(filename):
-        # Can also read CSV files with the headers index,time,lat,lon,alt,heading (since some SBET files didn't work with this reader).
-        rows = []
+        """Reads a CSV file with the headers index,time,lat,lon,alt,roll,pitch,heading (since some SBET files 
+        didn't work with the binary reader), with lat/lon in degrees. The rows are parsed column-wise into records 
+        of the same type as a binary SBET file (with lat/lon in radians and unused fields set to 0), which are
+        saved in a .npy file next to the CSV file (if possible). Later runs memory-map the .npy file instead of parsing the
+        CSV file again, as long as the CSV file has not been changed after it was created."""
+
+        cache_path = filename + ".npy"
+        record_type = np.dtype(sbet_record_types)
+
+        if os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(filename):
+            try:
+                records = np.load(cache_path, mmap_mode="r")
+                if records.dtype == record_type:
+                    return records
+            except:
+                pass
+
         with open(filename, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                row["index"] = int(row["index"])
-                row["time"] = float(row["time"])
-                row["lat"] = float(row["lat"])
-                row["lon"] = float(row["lon"])
-                row["alt"] = float(row["alt"])
-                row["roll"] = float(row["roll"])
-                row["pitch"] = float(row["pitch"])
-                row["heading"] = float(row["heading"])
-                rows.append(row)
-        return rows
+            header = [name.strip() for name in next(csv.reader(csvfile))]
+
+        names = ["time", "lat", "lon", "alt", "roll", "pitch", "heading"]
+        missing = [name for name in names if name not in header]
+        if len(missing) > 0:
+            raise Exception(f"The SBET CSV file {filename} is missing the column(s) {', '.join(missing)}.")
+
+        values = np.loadtxt(filename, delimiter=",", skiprows=1, usecols=[header.index(name) for name in names], dtype=np.float64, ndmin=2)
+
+        records = np.zeros(len(values), dtype=record_type)
+        for (i, name) in enumerate(names):
+            records[name] = values[:, i]
+
+        records["lat"] *= np.pi / 180
+        records["lon"] *= np.pi / 180
+
+        # The cache is only an optimization, so a read-only or full disk must not stop the CSV file from being used.
+        try:
+            with atomic_write(cache_path, "wb") as f:
+                np.save(f, records)
+        except OSError as e:
+            print(f"Could not cache the parsed SBET CSV file in {cache_path}: {e}")
+
+        return records
 
 
     @staticmethod
-    def read_latlon(sbet_filename, smrmsg_filename):
+    def read_latlon(sbet_filename, smrmsg_filename=None):
+        # The smrmsg file is not used, and is therefore not read.
+        return SbetParser.convert_records(read_sbet_records(sbet_filename))
 
-        (sbet, mmr) = read_sbet(sbet_filename, smrmsg_filename)
-        sbet = sbet[["time", "lat", "lon", "alt", "roll", "pitch", "heading"]]
-        sbet["lat"] = sbet["lat"] * 180 / np.pi
-        sbet["lon"] = sbet["lon"] * 180 / np.pi
+    @staticmethod
+    def convert_records(sbet):
+
+        # Copy the relevant fields to a new (packed) array, since a memory-mapped array is read-only.
+        names = ["time", "lat", "lon", "alt", "roll", "pitch", "heading"]
+        rows = np.empty(len(sbet), dtype=np.dtype([(name, np.float64) for name in names]))
+        for name in names:
+            rows[name] = sbet[name]
+
+        rows["lat"] *= 180 / np.pi
+        rows["lon"] *= 180 / np.pi
         
-        return sbet
+        return rows
 
     def get_rows(self, rotate=False):
-        coords = [SbetRow(row).calculate_transformed(self.transformer, self.gps_epoch) for row in self.rows]
-        if not rotate:
+        """Returns all rows in the SBET file as a Trajectory with transformed coordinates."""
+
+        self.load_all()
+
+        trajectory = np.zeros(self.row_count, dtype=TRAJECTORY_DTYPE)
+        trajectory["sow"] = self.times
+        trajectory["age"] = -self.times
+        trajectory["index"] = 0
+        for name in ["lat", "lon", "roll", "pitch", "heading"]:
+            trajectory[name] = self.get_column(name)
+
+        (trajectory["x"], trajectory["y"], trajectory["alt"]) = self.get_projected()
+
+        coords = Trajectory(trajectory)
+        if not rotate or len(coords) < 1:
             return coords
-        return SbetParser.rotate_points(coords, coords[0].heading)
+        return coords.rotate_points(coords[0].heading)
 
     @staticmethod
     def rotate_points(coords, heading):
-        """ Returns all coordinates rotated by the given heading. """
+        """ Returns all coordinates rotated by the given heading, around the first coordinate. A Trajectory is
+        rotated in place (see Trajectory.rotated for a rotated copy). Lists of SbetRows are rotated as arrays, 
+        and the rotated coordinates are written back to the rows. """
+
+        if isinstance(coords, Trajectory):
+            return coords.rotate_points(heading)
+
+        if len(coords) < 1:
+            return coords
 
-        transformed_path = o3d.geometry.LineSet(
-            points = o3d.utility.Vector3dVector([[p.x, p.y, p.alt] for p in coords]), lines = o3d.utility.Vector2iVector([])
-        )
-        R = transformed_path.get_rotation_matrix_from_xyz((0, 0, heading))
-        transformed_path.rotate(R, center=transformed_path.points[0])
+        x = np.array([c.x for c in coords], dtype=np.float64)
+        y = np.array([c.y for c in coords], dtype=np.float64)
+        (x, y) = rotate_xy(x, y, heading, x[0], y[0])
 
-        for i in range(len(coords)):
-            c = coords[i]
+        for (c, cx, cy) in zip(coords, x.tolist(), y.tolist()):
             c.lat = -1
             c.lon = -1
-            c.x = transformed_path.points[i][0]
-            c.y = transformed_path.points[i][1]
+            c.x = cx
+            c.y = cy
         
-        return coords
\ No newline at end of file
+        return coords
@@ -0,0 +1,256 @@
+import math
+import numpy as np
+
+from sbet.sbetRow import SbetRow
+
+TRAJECTORY_DTYPE = np.dtype([
+    ("sow", np.float64),
+    ("lat", np.float64),
+    ("lon", np.float64),
+    ("x", np.float64),
+    ("y", np.float64),
+    ("alt", np.float64),
+    ("roll", np.float64),
+    ("pitch", np.float64),
+    ("heading", np.float64),
+    ("age", np.float64),
+    ("index", np.int64)
+])
+
+def rotate_xy(x, y, heading, cx, cy):
+    """Returns the (x, y) arrays rotated by the given heading (radians) around (cx, cy)."""
+
+    dx = x - cx
+    dy = y - cy
+
+    cos = np.cos(heading)
+    sin = np.sin(heading)
+    return (cx + dx * cos - dy * sin, cy + dx * sin + dy * cos)
+
+def _field_property(name):
+    def getter(self):
+        return self.trajectory._data[name][self.ix].item()
+
+    def setter(self, value):
+        self.trajectory._data[name][self.ix] = value
+
+    return property(getter, setter)
+
+class TrajectoryRow:
+    """A lightweight view of a single row in a Trajectory. It has the same interface as an SbetRow,
+    but reads and writes directly from/to the trajectory arrays. The position of the row in the
+    trajectory is used as its frame_ix. Use clone() to get a detached SbetRow."""
+
+    __slots__ = ("trajectory", "ix")
+
+    sow = _field_property("sow")
+    lat = _field_property("lat")
+    lon = _field_property("lon")
+    x = _field_property("x")
+    y = _field_property("y")
+    alt = _field_property("alt")
+    roll = _field_property("roll")
+    pitch = _field_property("pitch")
+    heading = _field_property("heading")
+    age = _field_property("age")
+    index = _field_property("index")
+
+    def __init__(self, trajectory, ix):
+        self.trajectory = trajectory
+        self.ix = ix
+
+    @property
+    def frame_ix(self):
+        return self.ix
+
+    def __str__(self, include_lat_lon=True):
+        return f'ix={self.index}' + (f', lat={self.lat}, lon={self.lon}, roll={self.roll}, pitch={self.pitch}, heading={self.heading}' if include_lat_lon else '') + f', alt={self.alt}, x={self.x}, y={self.y}, time={self.sow}, age={self.age}'
+
+    def to_dict(self):
+        row = self.trajectory._data[self.ix]
+        values = { name: row[name].item() for name in TRAJECTORY_DTYPE.names }
+        values["frame_ix"] = self.ix
+        return values
+
+    def clone(self):
+        return SbetRow(None, None, None, self.to_dict())
+
+    def json(self, actual = False):
+        json = {
+            "x": self.x,
+            "y": self.y,
+            "z": self.alt,
+            "roll": self.roll,
+            "pitch": self.pitch,
+            "heading": self.heading
+        }
+
+        if actual:
+            json["age"] = self.age
+            json["index"] = self.index
+
+        json["frame_ix"] = self.ix
+
+        return json
+
+    def get_csv_headers(self):
+        return ["index", "time", "lat", "lon", "alt", "roll", "pitch", "heading", "x", "y"]
+
+    def get_csv(self):
+        return [self.index, self.sow, self.lat, self.lon, self.alt, self.roll, self.pitch, self.heading, self.x, self.y]
+
+    def distance2d(self, p):
+        dx = p.x - self.x
+        dy = p.y - self.y
+        return math.sqrt(dx*dx + dy*dy)
+
+    def translate(self, t):
+        row = self.trajectory._data[self.ix]
+        row["x"] += t[0]
+        row["y"] += t[1]
+        row["alt"] += t[2]
+        return self
+
+    def set(self, t):
+        row = self.trajectory._data[self.ix]
+        row["x"] = t[0]
+        row["y"] = t[1]
+        row["alt"] = t[2]
+        return self
+
+    def np(self):
+        row = self.trajectory._data[self.ix]
+        return np.array([row["x"], row["y"], row["alt"]])
+
+    def short_str(self):
+        return f"{self.x:.2f}, {self.y:.2f}"
+
+class Trajectory:
+    """A columnar store of positions (such as the SBET position of every frame in a pcap file),
+    backed by a NumPy structured array with the fields in TRAJECTORY_DTYPE. Indexing with an
+    integer returns a TrajectoryRow view, so that a trajectory can be used where a list of
+    SbetRows was used before, while bulk operations work directly on the arrays.
+
+    Rows can be appended; the underlying array grows by doubling its capacity.
+    """
+
+    def __init__(self, data=None, capacity=0):
+        if data is None:
+            data = np.zeros(capacity, dtype=TRAJECTORY_DTYPE)
+            self.count = 0
+        else:
+            self.count = len(data)
+        self._data = data
+
+    @property
+    def data(self):
+        return self._data[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            return Trajectory(self.data[ix].copy())
+
+        if ix < 0:
+            ix += self.count
+        if ix < 0 or ix >= self.count:
+            raise IndexError(f"Trajectory index {ix} is out of range (length {self.count}).")
+
+        return TrajectoryRow(self, ix)
+
+    def __iter__(self):
+        for ix in range(self.count):
+            yield TrajectoryRow(self, ix)
+
+    def append(self, row):
+        """Copies the values of the given row (SbetRow, TrajectoryRow or dict) to the end of the trajectory."""
+
+        if self.count >= len(self._data):
+            data = np.zeros(max(16, len(self._data) * 2), dtype=TRAJECTORY_DTYPE)
+            data[:self.count] = self.data
+            self._data = data
+
+        self._data[self.count] = Trajectory._row_values(row)
+        self.count += 1
+
+    def copy(self):
+        return Trajectory(self.data.copy())
+
+    @staticmethod
+    def _row_values(row):
+        if isinstance(row, dict):
+            return tuple(row.get("time" if name == "sow" and "sow" not in row else name, 0) for name in TRAJECTORY_DTYPE.names)
+        return tuple(getattr(row, name, 0) for name in TRAJECTORY_DTYPE.names)
+
+    @staticmethod
+    def from_rows(rows):
+        """Creates a trajectory from a list of SbetRows (or dicts with the same keys)."""
+        return Trajectory(np.array([Trajectory._row_values(row) for row in rows], dtype=TRAJECTORY_DTYPE))
+
+    @staticmethod
+    def concatenate(trajectories):
+        return Trajectory(np.concatenate([t.data for t in trajectories]))
+
+    @staticmethod
+    def from_json(data):
+        """Creates a trajectory from the output of to_json, or from a list of row dicts (the old cache format)."""
+
+        if isinstance(data, list):
+            return Trajectory.from_rows(data)
+
+        trajectory = np.zeros(len(data["x"]), dtype=TRAJECTORY_DTYPE)
+        for name in TRAJECTORY_DTYPE.names:
+            if name in data:
+                trajectory[name] = data[name]
+
+        return Trajectory(trajectory)
+
+    def to_json(self):
+        """Returns the trajectory as a dict of columns (lists), which is much more compact than one dict per row."""
+        return { name: self.data[name].tolist() for name in TRAJECTORY_DTYPE.names }
+
+    def points(self):
+        """Returns an (N, 3) array with the x, y and alt of every row."""
+        data = self.data
+        return np.column_stack((data["x"], data["y"], data["alt"]))
+
+    def translate(self, t):
+        data = self.data
+        data["x"] += t[0]
+        data["y"] += t[1]
+        data["alt"] += t[2]
+        return self
+
+    def rotate_points(self, heading):
+        """Rotates all positions by the given heading around the z axis, centered on the first
+        position. Lat/lon are set to -1, since they no longer correspond to the positions.
+        The positions are changed in place, see rotated for a rotated copy."""
+
+        data = self.data
+        if len(data) < 1:
+            return self
+
+        (data["x"], data["y"]) = rotate_xy(data["x"], data["y"], heading, data["x"][0], data["y"][0])
+        data["lat"] = -1
+        data["lon"] = -1
+
+        return self
+
+    def rotated(self, heading):
+        """Returns a copy of the trajectory rotated by the given heading (see rotate_points), leaving this
+        trajectory unchanged. Use this for trajectories that are cached (or memory-mapped)."""
+        return self.copy().rotate_points(heading)
+
+    def distance2d(self, p):
+        """Returns the 2D distance from every position to the given point (anything with x and y)."""
+        data = self.data
+        return np.hypot(data["x"] - p.x, data["y"] - p.y)
+
+    def find_first_inside_circle(self, center, radius):
+        """Returns the index of the first position within the given radius of the given center,
+        or -1 if no position is inside the circle."""
+
+        inside = np.flatnonzero(self.distance2d(center) <= radius)
+        return int(inside[0]) if len(inside) > 0 else -1
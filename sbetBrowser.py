@@ -5,6 +5,7 @@ from datetime import datetime
 import open3d as o3d
 import csv
 from sbet.sbetParser import SbetParser
+from sbet.sbetHelpers import timestamp_sow2unix
 from pcap.pcapReaderHelper import PcapReaderHelper
 
 if __name__ == "__main__":
@@ -19,6 +20,7 @@ if __name__ == "__main__":
 
     # Create and start a visualization
     parser = SbetParser(args.sbet, args.sbet_noise, args.sbet_noise_from_frame_ix, args.sbet_crs_from, args.sbet_crs_to)
+    parser.load_all()
     parser.gps_epoch = args.gps_epoch
     
     min_time = np.min(parser.rows["time"])
@@ -67,14 +69,18 @@ if __name__ == "__main__":
 
     else:
 
+        # Lines between each consecutive pair of coordinates.
+        lines = np.column_stack((np.arange(len(coords) - 1), np.arange(1, len(coords))))
+
         path = o3d.geometry.LineSet(
-            points = o3d.utility.Vector3dVector([[p.x, p.y, p.alt] for p in coords]), lines=o3d.utility.Vector2iVector([[i, i+1] for i in range(len(coords) - 1)])
+            points = o3d.utility.Vector3dVector(coords.points()), lines=o3d.utility.Vector2iVector(lines)
         )
         path.paint_uniform_color([1, 0, 0])
         
-        coords = parser.get_rows(rotate=True)
+        coords = coords.rotated(coords[0].heading)
+        points = coords.points()
         transformed_path = o3d.geometry.LineSet(
-            points = o3d.utility.Vector3dVector([[p.x, p.y, p.alt] for p in coords]), lines=o3d.utility.Vector2iVector([[i, i+1] for i in range(len(coords) - 1)])
+            points = o3d.utility.Vector3dVector(points), lines=o3d.utility.Vector2iVector(lines)
         )
         transformed_path.paint_uniform_color([0, 0, 1])
 
@@ -89,8 +95,8 @@ if __name__ == "__main__":
         vis.add_geometry(path)
         vis.add_geometry(actual_position_cylinder)
 
-        for c in tqdm(coords, ascii=True, desc="Animating"):
-            actual_position_cylinder.translate(c.np() + np.array([0, 0, position_cylinder_height / 2]), relative=False)
+        for p in tqdm(points, ascii=True, desc="Animating"):
+            actual_position_cylinder.translate(p + np.array([0, 0, position_cylinder_height / 2]), relative=False)
             vis.update_geometry(actual_position_cylinder)
             vis.refresh_non_blocking()
 
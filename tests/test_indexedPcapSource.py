@@ -0,0 +1,175 @@
+import struct
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("ouster.client")
+
+import pcap.indexedPcapSource as indexedPcapSource
+from pcap.indexedPcapSource import IndexedPcapSource
+
+LIDAR_PORT = 7502
+IMU_PORT = 7503
+LIDAR_PACKET_SIZE = 64
+IMU_PACKET_SIZE = 48
+
+class FakeClient:
+    """Stands in for ouster.client, so that the parsing can be tested without real sensor metadata."""
+
+    class PacketFormat:
+        @staticmethod
+        def from_info(metadata):
+            return SimpleNamespace(lidar_packet_size=LIDAR_PACKET_SIZE, imu_packet_size=IMU_PACKET_SIZE)
+
+    class LidarPacket:
+        def __init__(self, payload, metadata, timestamp):
+            self.payload = bytes(payload)
+
+    class ImuPacket:
+        def __init__(self, payload, metadata, timestamp):
+            self.payload = bytes(payload)
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch):
+    monkeypatch.setattr(indexedPcapSource, "client", FakeClient)
+
+class PcapWriter:
+    """Writes a libpcap file with Ethernet frames, building the IPv4/UDP headers (and fragments) by hand."""
+
+    def __init__(self, path):
+        self.f = open(path, "wb")
+        self.f.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        self.time = 0
+
+    def record(self, data):
+        self.time += 1
+        self.f.write(struct.pack("<IIII", self.time, 0, len(data), len(data)))
+        self.f.write(data)
+
+    def ethernet(self, payload, ether_type=0x0800):
+        self.record(b"\x00" * 12 + struct.pack(">H", ether_type) + payload)
+
+    def ip(self, content, ip_id, fragment_offset=0, more_fragments=False, protocol=17):
+        flags = (0x2000 if more_fragments else 0) | (fragment_offset // 8)
+        header = struct.pack(">BBHHHBBH4s4s", 0x45, 0, 20 + len(content), ip_id, flags, 64, protocol, 0, bytes([10, 0, 0, 1]), bytes([10, 0, 0, 2]))
+        self.ethernet(header + content)
+
+    @staticmethod
+    def udp(payload, port):
+        return struct.pack(">HHHH", 12345, port, 8 + len(payload), 0) + payload
+
+    def datagram(self, payload, port, ip_id=1):
+        self.ip(PcapWriter.udp(payload, port), ip_id)
+
+    @staticmethod
+    def fragments(payload, port, size=24):
+        """Returns the fragments of the datagram as (content, fragment_offset, more_fragments)."""
+        content = PcapWriter.udp(payload, port)
+        return [(content[i:i + size], i, i + size < len(content)) for i in range(0, len(content), size)]
+
+    def fragment(self, fragment, ip_id):
+        (content, fragment_offset, more_fragments) = fragment
+        self.ip(content, ip_id, fragment_offset, more_fragments)
+
+    def close(self):
+        self.f.close()
+
+def open_source(path, **kwargs):
+    return IndexedPcapSource(str(path), SimpleNamespace(udp_port_lidar=LIDAR_PORT, udp_port_imu=IMU_PORT), **kwargs)
+
+def payload(value, size=LIDAR_PACKET_SIZE):
+    return bytes([value]) * size
+
+def test_unfragmented_and_fragmented_datagrams(tmp_path):
+    path = tmp_path / "test.pcap"
+    writer = PcapWriter(path)
+    writer.datagram(payload(1), LIDAR_PORT)
+    for fragment in writer.fragments(payload(2), LIDAR_PORT):
+        writer.fragment(fragment, 7)
+    writer.datagram(payload(3, IMU_PACKET_SIZE), IMU_PORT)
+    writer.close()
+
+    payloads = list(open_source(path).enumerate_payloads())
+    offsets = [offset for (offset, _, _) in open_source(path).enumerate_records()]
+
+    assert [(port, bytes(data)) for (_, _, port, data) in payloads] == [(LIDAR_PORT, payload(1)), (LIDAR_PORT, payload(2)), (IMU_PORT, payload(3, IMU_PACKET_SIZE))]
+
+    # A reassembled datagram has the offset of the record with its first fragment.
+    assert [offset for (offset, _, _, _) in payloads] == [offsets[0], offsets[1], offsets[-1]]
+
+def test_out_of_order_fragments(tmp_path):
+    path = tmp_path / "test.pcap"
+    writer = PcapWriter(path)
+    for fragment in reversed(writer.fragments(payload(4), LIDAR_PORT)):
+        writer.fragment(fragment, 9)
+    writer.close()
+
+    assert [bytes(data) for (_, _, _, data) in open_source(path).enumerate_payloads()] == [payload(4)]
+
+def test_other_ports_and_protocols_are_ignored(tmp_path):
+    path = tmp_path / "test.pcap"
+    writer = PcapWriter(path)
+    writer.datagram(payload(1), LIDAR_PORT)
+    writer.datagram(payload(2), 9999)
+    writer.datagram(payload(3, IMU_PACKET_SIZE), LIDAR_PORT)
+    writer.ethernet(b"\x00" * 28, ether_type=0x0806)
+    writer.ip(PcapWriter.udp(payload(4), LIDAR_PORT), 1, protocol=6)
+    writer.datagram(payload(5, IMU_PACKET_SIZE), IMU_PORT)
+    writer.close()
+
+    packets = [packet for (_, packet) in open_source(path).enumerate_packets()]
+
+    assert [(type(packet), packet.payload) for packet in packets] == [(FakeClient.LidarPacket, payload(1)), (FakeClient.ImuPacket, payload(5, IMU_PACKET_SIZE))]
+
+def test_reused_ip_id_drops_the_incomplete_datagram(tmp_path):
+    path = tmp_path / "test.pcap"
+    writer = PcapWriter(path)
+    stale = writer.fragments(payload(1), LIDAR_PORT)
+    fresh = writer.fragments(payload(2), LIDAR_PORT)
+    writer.fragment(stale[0], 5)
+    for fragment in fresh:
+        writer.fragment(fragment, 5)
+    writer.close()
+
+    assert [bytes(data) for (_, _, _, data) in open_source(path).enumerate_payloads()] == [payload(2)]
+
+def test_old_fragments_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(indexedPcapSource, "FRAGMENT_MAX_AGE", 10)
+
+    path = tmp_path / "test.pcap"
+    writer = PcapWriter(path)
+    stale = writer.fragments(payload(1), LIDAR_PORT)
+    fresh = writer.fragments(payload(2), LIDAR_PORT)
+
+    # Without eviction, the first fragment of the new datagram would complete the stale one.
+    for fragment in stale[1:]:
+        writer.fragment(fragment, 5)
+    for i in range(20):
+        writer.datagram(payload(3), 9999, ip_id=100 + i)
+    for fragment in fresh:
+        writer.fragment(fragment, 5)
+    writer.close()
+
+    payloads = [bytes(data) for (_, _, port, data) in open_source(path).enumerate_payloads() if port == LIDAR_PORT]
+
+    assert payloads == [payload(2)]
+
+def test_reading_from_an_offset_matches_a_sequential_read(tmp_path):
+    path = tmp_path / "test.pcap"
+    writer = PcapWriter(path)
+    for i in range(6):
+        writer.datagram(payload(10 + i), LIDAR_PORT, ip_id=i)
+        for fragment in writer.fragments(payload(20 + i), LIDAR_PORT):
+            writer.fragment(fragment, 50 + i)
+    writer.close()
+
+    sequential = [(offset, bytes(data)) for (offset, _, _, data) in open_source(path).enumerate_payloads()]
+    (start, _) = sequential[5]
+
+    from_offset = [(offset, bytes(data)) for (offset, _, _, data) in open_source(path, start_offset=start).enumerate_payloads()]
+    assert from_offset == sequential[5:]
+
+    # A byte range covering two datagrams (one of them fragmented) gives exactly those datagrams.
+    (end, _) = sequential[7]
+    in_range = [(offset, bytes(data)) for (offset, _, _, data) in open_source(path, ranges=[(start, end)]).enumerate_payloads()]
+    assert in_range == sequential[5:7]
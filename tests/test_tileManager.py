@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+o3d = pytest.importorskip("open3d")
+laspy = pytest.importorskip("laspy")
+
+from pointCloud import TileIndex, TileManager
+
+def write_tile(path, points):
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.offsets = np.min(points, axis=0)
+    header.scales = np.array([0.001, 0.001, 0.001])
+
+    las = laspy.LasData(header)
+    las.x = points[:, 0]
+    las.y = points[:, 1]
+    las.z = points[:, 2]
+    las.write(path)
+
+def create_scene(origin):
+    """A floor with two walls, sampled every 5 cm, so that registration is constrained in every direction."""
+
+    (a, b) = np.meshgrid(np.arange(0, 4, 0.05), np.arange(0, 4, 0.05))
+    (a, b) = (a.ravel(), b.ravel())
+    zeros = np.zeros_like(a)
+
+    floor = np.column_stack((a, b, zeros))
+    wall_x = np.column_stack((zeros, a, b))
+    wall_y = np.column_stack((a, zeros, b))
+
+    return np.concatenate((floor, wall_x, wall_y)) + origin
+
+def test_registration_against_tile_crop(tmp_path):
+    if len(laspy.LazBackend.detect_available()) < 1:
+        pytest.skip("No LAZ backend available")
+
+    origin = np.array([600000.0, 6700000.0, 100.0])
+    write_tile(str(tmp_path / "tile.laz"), create_scene(origin))
+
+    tiles = TileManager(TileIndex(str(tmp_path), show_progress=False), dtype=np.float32)
+    center = origin - tiles.offset + np.array([2, 2, 1])
+    crop = tiles.crop(center - 3, center + 3)
+
+    assert crop.shape[1] == 6
+    assert np.allclose(np.linalg.norm(crop[:, 3:], axis=1), 1, atol=1e-3)
+
+    target = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(crop[:, :3].astype(np.float64)))
+    target.normals = o3d.utility.Vector3dVector(crop[:, 3:].astype(np.float64))
+
+    offset = np.array([0.1, -0.08, 0.05])
+    source = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(crop[:, :3].astype(np.float64) + offset))
+
+    reg = o3d.pipelines.registration.registration_icp(
+        source, target, 0.5, np.identity(4),
+        o3d.pipelines.registration.TransformationEstimationPointToPlane())
+
+    assert np.allclose(reg.transformation[:3, 3], -offset, atol=0.01)
@@ -0,0 +1,19 @@
+import os
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """Opens a temporary file next to the given path for writing, and renames it to the given path
+    when the block is done. Other processes (and later runs, if this one is interrupted) therefore
+    never see a half-written file. If the block fails, the temporary file is removed."""
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+        with open(temp_path, mode) as f:
+            yield f
+        os.replace(temp_path, path)
+    except:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
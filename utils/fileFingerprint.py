@@ -0,0 +1,8 @@
+import os
+
+def get_file_fingerprint(path):
+    """Returns the size and modification time of the given file, which the caches created from
+    the file are validated against (a file rewritten with the same size still changes the mtime)."""
+
+    stat = os.stat(path)
+    return { "size": stat.st_size, "mtime": stat.st_mtime }